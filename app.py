@@ -1,17 +1,33 @@
 import streamlit as st
+import streamlit.components.v1 as components
 from openai import OpenAI
 from supabase import create_client, Client
-import base64
-from PIL import Image, ImageEnhance
+from PIL import Image
 import io
 import json
 from datetime import datetime, timedelta, timezone
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 import urllib.parse
 import calendar
+import math
 import re
+import drug_index
+import image_pipeline
+import notifications
+import hashlib
+import copy
+import functools
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import TypedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 
 # ==================== 페이지 설정 ====================
 st.set_page_config(
@@ -271,6 +287,311 @@ def init_clients():
 
 client, supabase = init_clients()
 
+# ==================== HTTP 클라이언트 ====================
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def build_http_session(pool_maxsize, retry):
+    """keep-alive 연결 풀 + 재시도 설정이 된 requests 세션"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource
+def get_mfds_session():
+    """식약처 API용 공유 세션 (GET은 안전하므로 429/5xx 모두 재시도)"""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    return build_http_session(pool_maxsize=16, retry=retry)
+
+# ==================== 캐시 ====================
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "medimate_cache.sqlite3")
+MFDS_CACHE_TTL = 60 * 60 * 24  # 식약처 데이터는 자주 바뀌지 않으므로 하루 유지
+MFDS_CACHE_MAX_STALE = 60 * 60 * 24 * 30  # API 장애 시 만료된 결과라도 30일까지는 사용
+VISION_CACHE_TTL = 60 * 60 * 24 * 30  # 같은 약봉지 사진 재분석 방지 (30일)
+MEDICINE_INFO_CACHE_TTL = 60 * 60 * 24 * 7  # 약 이름별 GPT 약 정보 (7일)
+
+class TTLCache:
+    """만료 시간이 있는 스레드 안전 LRU 캐시 (프로세스 메모리)"""
+
+    def __init__(self, maxsize=256, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(적중 여부, 값) 반환. 만료된 항목은 지우고 미적중 처리"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class DiskCache:
+    """SQLite 기반 영구 캐시 (Streamlit 재시작 후에도 유지)"""
+
+    def __init__(self, namespace, path=CACHE_DB_PATH, max_entries=5000):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.commit()
+        except Exception as e:
+            # 디스크를 쓸 수 없는 환경이면 메모리 캐시만 사용
+            print(f"디스크 캐시 비활성화: {str(e)}")
+            self._conn = None
+
+    def get(self, key):
+        """(값, 만료시각) 반환. 없으면 None"""
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._conn.execute(
+                    "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (time.time(), self.namespace, key)
+                )
+                self._conn.commit()
+            return json.loads(row[0]), row[1]
+        except Exception as e:
+            print(f"디스크 캐시 조회 실패: {str(e)}")
+            return None
+
+    def set(self, key, value, ttl):
+        if self._conn is None:
+            return
+        try:
+            now = time.time()
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value, ensure_ascii=False), now + ttl, now)
+                )
+                # 오래 안 쓴 항목부터 정리
+                self._conn.execute("""
+                    DELETE FROM cache_entries
+                    WHERE namespace = ? AND key IN (
+                        SELECT key FROM cache_entries WHERE namespace = ?
+                        ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.namespace, self.namespace, self.max_entries))
+                self._conn.commit()
+        except Exception as e:
+            print(f"디스크 캐시 저장 실패: {str(e)}")
+
+    def items(self):
+        """만료되지 않은 (키, 값) 목록"""
+        if self._conn is None:
+            return []
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT key, value FROM cache_entries WHERE namespace = ? AND expires_at >= ? ORDER BY accessed_at",
+                    (self.namespace, time.time())
+                ).fetchall()
+            return [(key, json.loads(value)) for key, value in rows]
+        except Exception as e:
+            print(f"디스크 캐시 조회 실패: {str(e)}")
+            return []
+
+    def delete(self, key):
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                )
+                self._conn.commit()
+        except Exception as e:
+            print(f"디스크 캐시 삭제 실패: {str(e)}")
+
+class TieredCache:
+    """메모리(LRU+TTL) → 디스크(SQLite) 2단 캐시 + 적중/미적중/만료 카운터"""
+
+    def __init__(self, namespace, ttl, max_stale=0, maxsize=256, max_entries=5000):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(namespace, max_entries=max_entries)
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stale': 0, 'stores': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """
+        (상태, 값) 반환
+
+        상태: 'memory' / 'disk' (유효한 값), 'stale' (만료됐지만 장애 시 쓸 수 있는 값), 'miss'
+        """
+        hit, value = self.memory.get(key)
+        if hit:
+            self._count('memory_hits')
+            return 'memory', value
+
+        entry = self.disk.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            now = time.time()
+            if expires_at >= now:
+                self.memory.set(key, value, ttl=expires_at - now)
+                self._count('disk_hits')
+                return 'disk', value
+            if now - expires_at <= self.max_stale:
+                self._count('stale')
+                return 'stale', value
+
+        self._count('misses')
+        return 'miss', None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self.disk.set(key, value, self.ttl)
+        self._count('stores')
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self):
+        """카운터 스냅샷 + 적중률"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses'] + stats['stale']
+        hits = stats['memory_hits'] + stats['disk_hits']
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        return stats
+
+@st.cache_resource
+def get_mfds_cache():
+    """식약처 검색 결과 캐시 (모든 세션이 공유)"""
+    return TieredCache("mfds", ttl=MFDS_CACHE_TTL, max_stale=MFDS_CACHE_MAX_STALE)
+
+class ImageAnalysisCache:
+    """
+    약봉지 분석 결과 캐시 (전처리된 이미지 내용의 해시로 조회)
+    
+    similar=True면 지각 해시(dHash)가 거의 같은 사진도 같은 약봉지로 봅니다.
+    처방만 다른 같은 약국 봉투를 잘못 묶을 수 있어 기본값은 꺼져 있습니다.
+    """
+
+    def __init__(self, ttl, max_entries=1000, similar=False, max_distance=6):
+        self.results = TieredCache("vision", ttl=ttl, maxsize=64, max_entries=max_entries)
+        self.similar = similar
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._phashes = OrderedDict()
+        self._lock = threading.Lock()
+        if similar:
+            for key, value in self.results.disk.items():
+                if isinstance(value, dict) and value.get('phash') is not None:
+                    self._phashes[key] = value['phash']
+
+    def lookup(self, image):
+        """(분석 결과, 'exact' | 'similar') 반환. 없으면 (None, None)"""
+        key = image_content_hash(image)
+        status, value = self.results.get(key)
+        if status in ('memory', 'disk'):
+            return value['data'], 'exact'
+        
+        if self.similar:
+            phash = image_perceptual_hash(image)
+            with self._lock:
+                candidates = sorted(
+                    (bin(phash ^ other).count('1'), other_key)
+                    for other_key, other in self._phashes.items()
+                )
+            for distance, other_key in candidates:
+                if distance > self.max_distance:
+                    break
+                status, value = self.results.get(other_key)
+                if status in ('memory', 'disk'):
+                    return value['data'], 'similar'
+                with self._lock:
+                    # 이미 밀려난 항목은 색인에서도 제거
+                    self._phashes.pop(other_key, None)
+        return None, None
+
+    def store(self, image, data):
+        key = image_content_hash(image)
+        phash = image_perceptual_hash(image) if self.similar else None
+        self.results.set(key, {'data': data, 'phash': phash})
+        if phash is not None:
+            with self._lock:
+                self._phashes[key] = phash
+                self._phashes.move_to_end(key)
+                while len(self._phashes) > self.max_entries:
+                    self._phashes.popitem(last=False)
+
+@st.cache_resource
+def get_vision_cache():
+    """약봉지 분석 결과 캐시 (모든 세션이 공유)"""
+    return ImageAnalysisCache(
+        ttl=VISION_CACHE_TTL,
+        similar=bool(st.secrets.get("VISION_CACHE_SIMILAR", False))
+    )
+
+@st.cache_resource
+def get_medicine_info_cache():
+    """약 이름(보정 후)별 GPT 약 정보 캐시 (모든 세션이 공유)"""
+    return TieredCache("medicine_info", ttl=MEDICINE_INFO_CACHE_TTL, maxsize=512)
+
+def normalize_medicine_key(medicine_name):
+    """캐시 키용 약 이름 정규화 (공백 제거, 전각/반각 통일, 소문자)"""
+    name = unicodedata.normalize('NFKC', medicine_name or '')
+    return re.sub(r'\s+', '', name).lower()
+
 # ==================== 헬퍼 함수 ====================
 def parse_flexible_date(date_str):
     """AI가 읽은 다양한 날짜 형식을 datetime 객체로 변환"""
@@ -290,79 +611,162 @@ def parse_flexible_date(date_str):
             
     return None
 
+IMAGE_MAX_WORKERS = int(st.secrets.get("IMAGE_MAX_WORKERS", 2))  # 앱 전체에서 동시에 전처리하는 사진 수
+
+@st.cache_resource
+def get_image_semaphore():
+    """이미지 전처리 동시 실행 수 제한 (여러 세션이 동시에 스캔해도 CPU를 나눠 쓰도록)"""
+    return threading.BoundedSemaphore(IMAGE_MAX_WORKERS)
+
 def preprocess_image(image):
-    """OCR 성능 향상을 위한 이미지 전처리"""
+    """
+    OCR 성능 향상을 위한 이미지 전처리 (글자 영역만 잘라 Vision 해상도에 맞춘 뒤 NumPy로 보정)
+    
+    호출한 스레드에서 그대로 실행하고, 앱 전체 동시 실행 수만 IMAGE_MAX_WORKERS로 제한합니다.
+    알약·포장 색도 분석에 쓰이므로 컬러로 보정해 보냅니다.
+    """
     try:
-        if image.width < 1000:
-            ratio = 1000 / image.width
-            new_size = (int(image.width * ratio), int(image.height * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        enhancer = ImageEnhance.Sharpness(image)
-        image = enhancer.enhance(2.0)
-        
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(1.5)
-        
-        return image
+        with get_image_semaphore():
+            return image_pipeline.preprocess_for_ocr(image)
     except Exception as e:
-        st.warning(f"⚠️ 이미지 전처리 중 오류: {str(e)}")
+        # 여러 장 동시 분석 시 워커 스레드에서도 호출되므로 st.warning 대신 로그만 남김
+        print(f"이미지 전처리 오류, 원본으로 분석: {str(e)}")
         return image
 
+def image_content_hash(image):
+    """이미지 픽셀 내용의 SHA-256 (같은 사진이면 같은 값)"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def image_perceptual_hash(image, hash_size=16):
+    """차이 해시(dHash): 크기·압축만 다른 거의 같은 사진은 비트 차이가 작음"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
 # ==================== 식약처 API ====================
+def fetch_mfds_medicine(medicine_name):
+    """
+    식약처 e약은요 API 호출 (캐시 없이)
+
+    Returns:
+        검색 결과 리스트 (결과 없으면 빈 리스트), API 오류 응답이면 None
+    """
+    base_url = "https://apis.data.go.kr/1471000/DrbEasyDrugInfoService/getDrbEasyDrugList"
+    api_key = st.secrets["MFDS_API_KEY"]
+    
+    params = {
+        'itemName': medicine_name,
+        'pageNo': '1',
+        'numOfRows': '10',
+        'type': 'xml'
+    }
+    
+    encoded_params = urllib.parse.urlencode(params)
+    url = f"{base_url}?serviceKey={api_key}&{encoded_params}"
+    
+    response = get_mfds_session().get(url, timeout=10)
+    
+    if response.status_code == 200:
+        root = ET.fromstring(response.content)
+        result_code = root.find('.//resultCode')
+        
+        if result_code is not None and result_code.text == '00':
+            return [drug_index.parse_mfds_item(item) for item in root.findall('.//item')]
+    return None
+
+@st.cache_resource
+def get_drug_index():
+    """로컬 e약은요 색인 (python drug_index.py sync 로 생성)"""
+    return drug_index.DrugIndex(st.secrets.get("DRUG_INDEX_PATH", drug_index.DEFAULT_INDEX_PATH))
+
+@st.cache_resource(max_entries=1)
+def get_drug_name_matcher(index_version):
+    """약 이름 보정용 메모리 사전 (index_version이 바뀌면 = 색인 재동기화 시 새로 생성)"""
+    return drug_index.DrugNameMatcher(get_drug_index().names())
+
+def resolve_medicine_names(medicines):
+    """
+    OCR로 읽은 약 이름들을 정식 제품명으로 보정 (GPT/캐시 조회 전에 실행)
+    
+    Returns:
+        [{'ocr', 'name', 'confidence', 'corrected'}] — 색인이 없으면 원래 이름 그대로
+    """
+    index_version = get_drug_index().version
+    if index_version is None:
+        return [{'ocr': name, 'name': name, 'confidence': None, 'corrected': False} for name in medicines]
+    matcher = get_drug_name_matcher(index_version)
+    return [matcher.resolve(name) for name in medicines]
+
 def search_mfds_medicine(medicine_name):
-    """식약처 e약은요 API로 의약품 검색"""
+    """
+    식약처 e약은요 의약품 검색
+    
+    로컬 색인(오타 허용)에서 먼저 찾고, 색인이 없거나 결과가 없을 때만
+    e약은요 API를 호출합니다 (메모리 + 디스크 캐시).
+    """
     try:
-        base_url = "http://apis.data.go.kr/1471000/DrbEasyDrugInfoService/getDrbEasyDrugList"
-        api_key = st.secrets["MFDS_API_KEY"]
-        
-        params = {
-            'itemName': medicine_name,
-            'pageNo': '1',
-            'numOfRows': '10',
-            'type': 'xml'
-        }
-        
-        encoded_params = urllib.parse.urlencode(params)
-        url = f"{base_url}?serviceKey={api_key}&{encoded_params}"
-        
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            result_code = root.find('.//resultCode')
-            
-            if result_code is not None and result_code.text == '00':
-                items = root.findall('.//item')
-                if not items:
-                    return None
-                
-                results = []
-                for item in items:
-                    medicine_info = {
-                        '제품명': item.find('itemName').text if item.find('itemName') is not None else '',
-                        '업체명': item.find('entpName').text if item.find('entpName') is not None else '',
-                        '효능효과': item.find('efcyQesitm').text if item.find('efcyQesitm') is not None else '정보 없음',
-                        '사용법': item.find('useMethodQesitm').text if item.find('useMethodQesitm') is not None else '정보 없음',
-                        '주의사항': item.find('atpnQesitm').text if item.find('atpnQesitm') is not None else '정보 없음',
-                        '낱알이미지': item.find('itemImage').text if item.find('itemImage') is not None else '',
-                    }
-                    results.append(medicine_info)
-                return results
-        return None
+        local_results = get_drug_index().search(medicine_name)
+        if local_results:
+            return [info for info, _ in local_results]
+    except Exception as e:
+        print(f"로컬 약 색인 검색 실패: {str(e)}")
+    
+    cache = get_mfds_cache()
+    key = normalize_medicine_key(medicine_name)
+    status, cached = cache.get(key) if key else ('miss', None)
+    
+    if status in ('memory', 'disk'):
+        return cached or None
+    
+    try:
+        results = fetch_mfds_medicine(medicine_name)
     except Exception as e:
+        if status == 'stale':
+            # 식약처 API 장애 시 만료된 결과라도 보여줌
+            return cached or None
         st.error(f"❌ 식약처 API 오류: {str(e)}")
         return None
+    
+    if results is None:
+        if status == 'stale':
+            return cached or None
+        return None
+    
+    # "검색 결과 없음"도 캐시해서 같은 오타로 반복 호출하지 않음
+    if key:
+        cache.set(key, results)
+    return results or None
 
 # ==================== GPT 함수 ====================
-def search_medicine_info_gpt(medicine_name):
-    """GPT로 약물 정보 검색"""
-    try:
-        prompt = f"""
-다음 약물에 대한 상세 정보를 JSON 형식으로 제공해주세요:
-약물명: {medicine_name}
-
-{{
+ENRICH_MAX_WORKERS = int(st.secrets.get("ENRICH_MAX_WORKERS", 4))  # 동시에 보내는 GPT 요청 수
+GPT_TIMEOUT = float(st.secrets.get("GPT_TIMEOUT", 30))  # 약 1개당 GPT 응답 대기 시간(초)
+
+class MedicineBagResult(TypedDict):
+    """약봉지 분석 결과"""
+    medicines: list[str]
+    hospital: str
+    date: str
+
+class MedicineInfo(TypedDict):
+    """약 정보 카드"""
+    약품명: str
+    분류: str
+    효능효과: str
+    용법용량: str
+    주의사항: str
+    부작용: str
+    보관방법: str
+
+MEDICINE_INFO_FIELDS = {
     "약품명": "정확한 약품명",
     "분류": "약물 분류",
     "효능효과": "주요 효능",
@@ -370,44 +774,470 @@ def search_medicine_info_gpt(medicine_name):
     "주의사항": "주의할 점",
     "부작용": "부작용",
     "보관방법": "보관법"
-}}
+}
+
+MEDICINE_INFO_SCHEMA = json.dumps(MEDICINE_INFO_FIELDS, ensure_ascii=False, indent=4)
+
+def string_object_schema(fields):
+    """모든 필드가 필수 문자열인 JSON 스키마 (strict 모드는 required/additionalProperties 필수)"""
+    return {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in fields},
+        "required": list(fields),
+        "additionalProperties": False
+    }
+
+MEDICINE_BAG_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "medicines": {"type": "array", "items": {"type": "string"}},
+        "hospital": {"type": "string"},
+        "date": {"type": "string"}
+    },
+    "required": ["medicines", "hospital", "date"],
+    "additionalProperties": False
+}
+
+MEDICINE_INFO_JSON_SCHEMA = string_object_schema(MEDICINE_INFO_FIELDS)
+
+# strict 모드는 최상위가 객체여야 하므로 배열을 items로 감쌈
+MEDICINE_BATCH_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {"type": "array", "items": string_object_schema(["입력명", *MEDICINE_INFO_FIELDS])}
+    },
+    "required": ["items"],
+    "additionalProperties": False
+}
+
+def json_schema_format(name, schema):
+    """Structured Outputs용 response_format"""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+def build_medicine_info_prompt(medicine_name):
+    """약 1개용 정보 요청 프롬프트"""
+    return f"""
+다음 약물에 대한 상세 정보를 JSON 형식으로 제공해주세요:
+약물명: {medicine_name}
+
+{MEDICINE_INFO_SCHEMA}
 
 반드시 유효한 JSON으로만 답변하세요.
 """
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
-        
-        result = response.choices[0].message.content.strip()
-        if result.startswith("```json"):
-            result = result[7:]
-        if result.endswith("```"):
-            result = result[:-3]
-        
-        return json.loads(result.strip())
-    except Exception as e:
-        st.error(f"❌ GPT 검색 오류: {str(e)}")
+
+def build_medicine_batch_prompt(medicine_names):
+    """여러 약을 한 번에 묻는 프롬프트 ({"items": [...]} 응답)"""
+    name_lines = "\n".join(f"{idx + 1}. {name}" for idx, name in enumerate(medicine_names))
+    return f"""
+다음 약물들에 대한 상세 정보를 JSON 객체의 "items" 배열로 제공해주세요:
+{name_lines}
+
+배열의 각 항목은 아래 형식에 "입력명" 필드를 더한 객체입니다.
+"입력명"에는 위 목록의 약물명을 그대로 적고, 목록 순서대로 한 항목씩 작성하세요.
+
+{MEDICINE_INFO_SCHEMA}
+
+반드시 유효한 JSON으로만 답변하세요.
+"""
+
+def coerce_medicine_bag(data) -> MedicineBagResult:
+    """파싱한 약봉지 분석 결과를 MedicineBagResult 형태로 정리"""
+    if not isinstance(data, dict):
+        raise ValueError("약봉지 분석 결과가 객체가 아닙니다")
+    medicines = data.get('medicines')
+    return {
+        'medicines': [name.strip() for name in medicines if isinstance(name, str) and name.strip()]
+        if isinstance(medicines, list) else [],
+        'hospital': str(data.get('hospital') or ''),
+        'date': str(data.get('date') or '')
+    }
+
+def coerce_medicine_info(data, medicine_name='') -> MedicineInfo:
+    """파싱한 약 정보를 MedicineInfo 형태로 정리 (약품명이 비면 입력한 이름 사용)"""
+    if not isinstance(data, dict):
+        raise ValueError("약 정보가 객체가 아닙니다")
+    info = {field: str(data.get(field) or '') for field in MEDICINE_INFO_FIELDS}
+    if not info['약품명']:
+        info['약품명'] = medicine_name
+    return info
+
+def strip_json_fence(text):
+    """GPT 응답에서 ```json 코드 블록 표시 제거"""
+    result = text.strip()
+    if result.startswith("```json"):
+        result = result[7:]
+    if result.startswith("```"):
+        result = result[3:]
+    if result.endswith("```"):
+        result = result[:-3]
+    return result.strip()
+
+STREAM_PARSE_INTERVAL = 24  # 스트리밍 중 이만큼(글자) 더 받을 때마다 부분 JSON을 다시 파싱
+
+def close_partial_json(fragment):
+    """
+    끝나지 않은 JSON 조각을 닫아서 파싱 가능한 문자열로 만들기
+    
+    Returns:
+        (닫은 문자열, 값을 잘라도 되는 위치 리스트)
+    """
+    stack = []
+    boundaries = []
+    in_string = False
+    escaped = False
+    for position, char in enumerate(fragment):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            boundaries.append(position + 1)
+        elif char in '}]':
+            if stack:
+                stack.pop()
+        elif char == ',':
+            boundaries.append(position)
+    
+    closed = fragment
+    if in_string:
+        if escaped:
+            closed = closed[:-1]
+        closed += '"'
+    closed = closed.rstrip()
+    if closed.endswith(','):
+        closed = closed[:-1]
+    elif closed.endswith(':'):
+        closed += ' null'
+    return closed + ''.join(reversed(stack)), boundaries
+
+def parse_partial_json(text):
+    """스트리밍으로 받는 중인 JSON을 지금까지 받은 만큼 파싱 (못 하면 None)"""
+    text = text.lstrip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    starts = [position for position in (text.find('{'), text.find('[')) if position >= 0]
+    if not starts:
         return None
+    # 끝에 붙는 코드 펜스는 JSON이 아니므로 제거
+    fragment = text[min(starts):].split("```", 1)[0]
+    
+    # 닫아도 안 되면(키만 있고 값이 없는 경우 등) 마지막 완성된 값까지 잘라서 재시도
+    for _ in range(4):
+        closed, boundaries = close_partial_json(fragment)
+        try:
+            return json.loads(closed)
+        except json.JSONDecodeError:
+            earlier = [position for position in boundaries if position < len(fragment)]
+            if not earlier:
+                return None
+            fragment = fragment[:earlier[-1]]
+    return None
+
+SMART_QUOTES = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+def repair_json(text):
+    """
+    거의 맞는 JSON을 가볍게 고쳐서 파싱 (설명 문장, 코드 펜스, 둥근 따옴표, 끝 쉼표, 잘린 끝)
+    
+    Raises:
+        json.JSONDecodeError: 고쳐도 파싱할 수 없을 때
+    """
+    candidate = strip_json_fence(text).translate(SMART_QUOTES)
+    starts = [position for position in (candidate.find('{'), candidate.find('[')) if position >= 0]
+    if starts:
+        candidate = candidate[min(starts):]
+        end = max(candidate.rfind('}'), candidate.rfind(']'))
+        if end >= 0:
+            # JSON 뒤에 붙은 설명 문장 제거
+            candidate = candidate[:end + 1]
+    candidate = TRAILING_COMMA.sub(r'\1', candidate)
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        # max_tokens 등으로 끝이 잘린 응답은 열린 괄호를 닫아서 살림
+        return json.loads(close_partial_json(candidate)[0])
+
+class ParseMetrics:
+    """GPT 응답 JSON 파싱 결과 집계 (종류별 성공/복구/실패 횟수)"""
+    
+    OUTCOMES = ('ok', 'repaired', 'failed')
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+    
+    def record(self, source, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(source, dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+    
+    def stats(self):
+        with self._lock:
+            counts = {source: dict(values) for source, values in self._counts.items()}
+        total = sum(sum(values.values()) for values in counts.values())
+        failed = sum(values['failed'] for values in counts.values())
+        repaired = sum(values['repaired'] for values in counts.values())
+        return {
+            'sources': counts,
+            'total': total,
+            'repaired': repaired,
+            'failed': failed,
+            'failure_rate': failed / total if total else 0.0
+        }
 
-def analyze_medicine_bag(image):
-    """약봉지 이미지 분석"""
+@st.cache_resource
+def get_parse_metrics():
+    """앱 전체에서 공유하는 파싱 통계"""
+    return ParseMetrics()
+
+def parse_json_response(text, source):
+    """
+    GPT 응답을 JSON으로 파싱하고 결과를 통계에 기록
+    
+    Raises:
+        json.JSONDecodeError: 복구 시도까지 실패했을 때
+    """
+    metrics = get_parse_metrics()
     try:
-        image = preprocess_image(image)
-        
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        data = json.loads(text)
+        metrics.record(source, 'ok')
+        return data
+    except json.JSONDecodeError:
+        pass
+    try:
+        data = repair_json(text)
+        metrics.record(source, 'repaired')
+        return data
+    except json.JSONDecodeError:
+        metrics.record(source, 'failed')
+        raise
+
+def stream_chat_completion(chat_client, on_partial=None, **kwargs):
+    """
+    chat completion을 스트리밍으로 받아 전체 텍스트 반환
+    
+    on_partial이 있으면 받는 도중 부분 파싱된 JSON을 넘겨줍니다.
+    
+    Returns:
+        (응답 텍스트, usage 또는 None)
+    """
+    stream = chat_client.chat.completions.create(
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs
+    )
+    text = ""
+    usage = None
+    parsed_length = 0
+    for chunk in stream:
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        text += chunk.choices[0].delta.content or ""
+        if on_partial and len(text) - parsed_length >= STREAM_PARSE_INTERVAL:
+            parsed_length = len(text)
+            partial = parse_partial_json(text)
+            if partial is not None:
+                on_partial(partial)
+    return text, usage
+
+def fetch_medicine_info_gpt(medicine_name, timeout=GPT_TIMEOUT):
+    """
+    GPT로 약물 정보 검색 (실패 시 예외 발생, 워커 스레드에서 사용)
+    
+    Returns:
+        (약 정보 dict, 사용한 프롬프트 토큰 수)
+    """
+    response = client.with_options(timeout=timeout, max_retries=1).chat.completions.create(
+        model="gpt-4o",
+        messages=[{"role": "user", "content": build_medicine_info_prompt(medicine_name)}],
+        response_format=json_schema_format("medicine_info", MEDICINE_INFO_JSON_SCHEMA),
+        temperature=0.3
+    )
+    
+    prompt_tokens = response.usage.prompt_tokens if response.usage else 0
+    data = parse_json_response(response.choices[0].message.content or "", 'medicine_info')
+    return coerce_medicine_info(data, medicine_name), prompt_tokens
+
+def batch_entries(data):
+    """배치 응답({"items": [...]})에서 항목 리스트 꺼내기 (배열이나 단일 객체로 온 경우도 허용)"""
+    if isinstance(data, dict):
+        data = data['items'] if isinstance(data.get('items'), list) else [data]
+    return data if isinstance(data, list) else []
+
+def match_batch_entries(entries, medicine_names):
+    """배치 응답 항목을 입력 순번에 매칭 ({입력 순번: 항목})"""
+    name_to_idx = {normalize_medicine_key(name): idx for idx, name in enumerate(medicine_names)}
+    matched = {}
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            continue
+        input_name = str(entry.get('입력명') or '').strip()
+        if input_name:
+            # 입력명이 있는데 모르는 이름이면 매칭하지 않음 (개별 검색으로 보충)
+            idx = name_to_idx.get(normalize_medicine_key(input_name))
+        elif len(entries) == len(medicine_names):
+            # 입력명을 빠뜨렸으면 항목 수가 맞을 때만 순서로 매칭
+            idx = position
+        else:
+            idx = None
+        if idx is not None and idx not in matched:
+            matched[idx] = entry
+    return matched
+
+def fetch_medicine_info_gpt_batch(medicine_names, timeout=GPT_TIMEOUT, on_partial=None):
+    """
+    여러 약의 정보를 GPT 한 번 호출로 검색 (스트리밍)
+    
+    Args:
+        on_partial: 받는 도중 호출되는 콜백 (입력 순번, 지금까지 채워진 약 정보)
+    
+    Returns:
+        ({입력 순번: 약 정보}, 프롬프트 토큰 수, 프롬프트 길이)
+        형식이 깨진 항목은 결과에서 빠지므로 호출한 쪽에서 개별 검색으로 보충
+    """
+    prompt = build_medicine_batch_prompt(medicine_names)
+    
+    def report_partial(partial):
+        for idx, entry in match_batch_entries(batch_entries(partial), medicine_names).items():
+            on_partial(idx, entry)
+    
+    # 응답이 약 개수만큼 길어지므로 대기 시간도 늘림
+    text, usage = stream_chat_completion(
+        client.with_options(timeout=timeout * 2, max_retries=1),
+        on_partial=report_partial if on_partial else None,
+        model="gpt-4o",
+        messages=[{"role": "user", "content": prompt}],
+        response_format=json_schema_format("medicine_info_batch", MEDICINE_BATCH_JSON_SCHEMA),
+        temperature=0.3
+    )
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    
+    try:
+        entries = batch_entries(parse_json_response(text, 'medicine_info_batch'))
+    except json.JSONDecodeError:
+        return {}, prompt_tokens, len(prompt)
+    
+    infos = {}
+    for idx, entry in match_batch_entries(entries, medicine_names).items():
+        if entry.get('약품명'):
+            infos[idx] = coerce_medicine_info(entry, medicine_names[idx])
+    
+    return infos, prompt_tokens, len(prompt)
+
+def enrich_medicines(medicines, on_progress=None, max_workers=ENRICH_MAX_WORKERS, timeout=GPT_TIMEOUT, batch=True, on_partial=None, aligned=False):
+    """
+    여러 약의 정보를 검색 (입력 순서 유지)
+    
+    먼저 약 정보 캐시에서 찾고, 없는 약만 batch=True면 GPT 한 번으로 묻습니다.
+    응답에서 빠지거나 깨진 약만 개별 호출로 동시에 다시 검색합니다.
+    
+    Args:
+        medicines: 약 이름 리스트
+        on_progress: 약 하나가 끝날 때마다 호출되는 콜백 (완료 수, 전체 수, 약 이름)
+        max_workers: 개별 호출 동시 요청 수 상한
+        timeout: 약 1개당 응답 대기 시간(초)
+        batch: 한 번에 묻는 배치 모드 사용 여부
+        on_partial: 배치 응답을 받는 도중 호출되는 콜백 (입력 순번, 지금까지 채워진 약 정보)
+        aligned: True면 약 정보 리스트를 입력 순서 그대로 반환 (실패한 자리는 None)
+    
+    Returns:
+        (약 정보 리스트, 실패한 약 [(이름, 오류 메시지)], 토큰 통계 dict)
+    """
+    token_stats = {
+        'api_calls': 0,
+        'cache_hits': 0,
+        'prompt_tokens': 0,
+        'estimated_unbatched_prompt_tokens': 0,
+        'tokens_saved': 0
+    }
+    if not medicines:
+        return [], [], token_stats
+    
+    results = [None] * len(medicines)
+    failures = []
+    done_count = 0
+    info_cache = get_medicine_info_cache()
+    
+    def finish(idx, info):
+        nonlocal done_count
+        results[idx] = info
+        done_count += 1
+        if on_progress:
+            on_progress(done_count, len(medicines), medicines[idx])
+    
+    for idx, medicine_name in enumerate(medicines):
+        status, cached = info_cache.get(normalize_medicine_key(medicine_name))
+        if status in ('memory', 'disk'):
+            token_stats['cache_hits'] += 1
+            finish(idx, cached)
+    
+    pending = [idx for idx, info in enumerate(results) if info is None]
+    if batch and len(pending) > 1:
+        try:
+            batch_names = [medicines[idx] for idx in pending]
+            report_partial = (lambda batch_idx, entry: on_partial(pending[batch_idx], entry)) if on_partial else None
+            batch_infos, batch_tokens, prompt_length = fetch_medicine_info_gpt_batch(batch_names, timeout, on_partial=report_partial)
+            token_stats['api_calls'] += 1
+            token_stats['prompt_tokens'] += batch_tokens
+            for batch_idx, info in batch_infos.items():
+                idx = pending[batch_idx]
+                info_cache.set(normalize_medicine_key(medicines[idx]), info)
+                # 개별 호출했을 때의 프롬프트 토큰을 배치 호출의 글자당 토큰 비율로 추정
+                single_length = len(build_medicine_info_prompt(medicines[idx]))
+                token_stats['estimated_unbatched_prompt_tokens'] += round(batch_tokens * single_length / prompt_length)
+                finish(idx, info)
+        except Exception as e:
+            print(f"배치 약 정보 검색 실패, 개별 검색으로 전환: {str(e)}")
+    
+    pending = [idx for idx, info in enumerate(results) if info is None]
+    if pending:
+        workers = max(1, min(max_workers, len(pending)))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = {
+            executor.submit(fetch_medicine_info_gpt, medicines[idx], timeout): idx
+            for idx in pending
+        }
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": """약봉지 사진을 분석해서 다음 정보를 추출해주세요.
+        try:
+            # 재시도 1회를 감안한 1개당 한도 × 워커 수만큼씩 차례로 도는 횟수
+            rounds = math.ceil(len(pending) / workers)
+            for future in as_completed(futures, timeout=(timeout * 2 + 5) * rounds):
+                idx = futures[future]
+                token_stats['api_calls'] += 1
+                try:
+                    info, prompt_tokens = future.result()
+                except Exception as e:
+                    failures.append((medicines[idx], str(e)))
+                    done_count += 1
+                    if on_progress:
+                        on_progress(done_count, len(medicines), medicines[idx])
+                    continue
+                token_stats['prompt_tokens'] += prompt_tokens
+                token_stats['estimated_unbatched_prompt_tokens'] += prompt_tokens
+                info_cache.set(normalize_medicine_key(medicines[idx]), info)
+                finish(idx, info)
+        except FuturesTimeoutError:
+            for future, idx in futures.items():
+                if not future.done():
+                    failures.append((medicines[idx], "응답 시간 초과"))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    token_stats['tokens_saved'] = max(0, token_stats['estimated_unbatched_prompt_tokens'] - token_stats['prompt_tokens'])
+    if aligned:
+        return results, failures, token_stats
+    return [info for info in results if info], failures, token_stats
+
+MEDICINE_BAG_PROMPT = """약봉지 사진을 분석해서 다음 정보를 추출해주세요.
 
 중요한 규칙:
 1. 약 이름은 최대한 정확하게 읽어주세요
@@ -422,41 +1252,153 @@ def analyze_medicine_bag(image):
 }
 
 다른 텍스트나 설명 없이 오직 JSON만 출력하세요."""
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                    }
-                ]
-            }],
-            max_tokens=1500,
-            temperature=0.1
-        )
-        
-        result = response.choices[0].message.content.strip()
-        
-        if result.startswith("```json"):
-            result = result[7:]
-        if result.startswith("```"):
-            result = result[3:]
-        if result.endswith("```"):
-            result = result[:-3]
-        
-        result = result.strip()
-        
-        data = json.loads(result)
-        
-        if not isinstance(data.get('medicines'), list):
-            data['medicines'] = []
-        
-        return data
-        
-    except json.JSONDecodeError as e:
-        st.error(f"❌ JSON 파싱 오류: {str(e)}")
-        return None
-    except Exception as e:
-        st.error(f"❌ 이미지 분석 오류: {str(e)}")
-        return None
+
+def run_medicine_bag_analysis(image, on_partial=None, original_bytes=0):
+    """
+    약봉지 이미지 분석 (실패 시 예외 발생, 워커 스레드에서도 사용)
+    
+    Args:
+        on_partial: 스트리밍 도중 부분 파싱된 결과 dict를 받는 콜백
+        original_bytes: 업로드된 원본 파일 크기 (절약량 계산용)
+    
+    Returns:
+        (MedicineBagResult, 캐시 적중 종류 'exact' | 'similar' | None, 업로드 절약량 dict 또는 None)
+    """
+    original_size = image.size
+    image = preprocess_image(image)
+    
+    vision_cache = get_vision_cache()
+    cached, match = vision_cache.lookup(image)
+    if cached:
+        return copy.deepcopy(cached), match, None
+    
+    # 무손실 PNG 대신 용량 예산에 맞춘 WebP/JPEG로 전송
+    encoded = image_pipeline.encode_for_vision(image)
+    upload_stats = image_pipeline.upload_savings(original_size, original_bytes, encoded)
+    
+    def report_partial(partial):
+        if isinstance(partial, dict):
+            on_partial(partial)
+    
+    result, _ = stream_chat_completion(
+        client,
+        on_partial=report_partial if on_partial else None,
+        model="gpt-4o",
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": MEDICINE_BAG_PROMPT},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": encoded['data_url'], "detail": "high"}
+                }
+            ]
+        }],
+        response_format=json_schema_format("medicine_bag", MEDICINE_BAG_JSON_SCHEMA),
+        max_tokens=1500,
+        temperature=0.1
+    )
+    
+    data = coerce_medicine_bag(parse_json_response(result, 'medicine_bag'))
+    
+    # 약을 하나도 못 읽은 결과는 재시도할 수 있게 캐시하지 않음
+    if data['medicines']:
+        vision_cache.store(image, copy.deepcopy(data))
+    
+    return data, None, upload_stats
+
+SCAN_MAX_WORKERS = int(st.secrets.get("SCAN_MAX_WORKERS", 3))  # 여러 장 스캔 시 동시에 분석하는 약봉지 수
+
+def analyze_medicine_bags(images, max_workers=SCAN_MAX_WORKERS, on_done=None):
+    """
+    여러 약봉지를 동시에 분석 (동시 Vision 요청 수는 max_workers로 제한)
+    
+    Args:
+        images: [(PIL 이미지, 원본 파일 크기)]
+        on_done: 한 장 끝날 때마다 호출되는 콜백 (끝난 수, 전체 수)
+    
+    Returns:
+        입력 순서대로 [(분석 결과 또는 None, 업로드 절약량 또는 None, 캐시 적중 종류, 오류 메시지 또는 None)]
+    """
+    outcomes = [None] * len(images)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as executor:
+        futures = {
+            executor.submit(run_medicine_bag_analysis, image, original_bytes=original_bytes): idx
+            for idx, (image, original_bytes) in enumerate(images)
+        }
+        for done_count, future in enumerate(as_completed(futures), start=1):
+            idx = futures[future]
+            try:
+                data, match, upload_stats = future.result()
+                outcomes[idx] = (data, upload_stats, match, None)
+            except Exception as e:
+                outcomes[idx] = (None, None, None, str(e))
+            if on_done:
+                on_done(done_count, len(images))
+    return outcomes
+
+def merge_bag_medicines(medicine_lists):
+    """여러 약봉지의 약 이름을 합쳐 중복 제거 (정규화한 이름 기준, 처음 나온 이름과 순서 유지)"""
+    unique = {}
+    for medicines in medicine_lists:
+        for medicine_name in medicines:
+            unique.setdefault(normalize_medicine_key(medicine_name), medicine_name)
+    return list(unique.values())
+
+# ==================== 세션 조회 캐시 ====================
+SESSION_CACHE_TTL = 60  # 다른 가족 세션에서 바뀐 내용도 늦어도 이 시간 안에 반영
+
+def session_cached(namespace, default=None, error_message=None, ttl=SESSION_CACHE_TTL):
+    """
+    세션 단위 조회 캐시 데코레이터
+    
+    Streamlit은 클릭할 때마다 스크립트 전체를 다시 실행하므로, 같은 인자로 다시
+    부른 조회는 st.session_state에 저장된 결과를 돌려줍니다. 쓰기 함수는
+    invalidate_session_cache(namespace)로 해당 영역만 비웁니다.
+    
+    Args:
+        namespace: 무효화 단위 ('records', 'notifications', 'family')
+        default: 조회 실패 시 반환값을 만드는 함수 (예: list). 실패 결과는 캐시하지 않음
+        error_message: 실패 시 st.error로 보여줄 문구 (없으면 조용히 기본값 반환)
+        ttl: 결과 유지 시간 (초)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = st.session_state.setdefault('_query_cache', {})
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            entry = cache.get(namespace, {}).get(key)
+            if entry and entry[0] > time.time():
+                return copy.deepcopy(entry[1])
+            
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if error_message:
+                    st.error(f"{error_message}: {str(e)}")
+                return default() if default else None
+            
+            cache.setdefault(namespace, {})[key] = (time.time() + ttl, result)
+            return copy.deepcopy(result)
+        return wrapper
+    return decorator
+
+def peek_session_cache(namespace, func_name):
+    """만료되지 않은 캐시 항목 [(위치 인자, 결과)] (조회 없이 이미 받아 둔 결과만 확인)"""
+    entries = st.session_state.get('_query_cache', {}).get(namespace, {})
+    now = time.time()
+    return [
+        (key[1], entry[1]) for key, entry in entries.items()
+        if key[0] == func_name and entry[0] > now
+    ]
+
+def invalidate_session_cache(*namespaces):
+    """쓰기 후 해당 영역의 세션 조회 캐시 비우기"""
+    cache = st.session_state.get('_query_cache')
+    if not cache:
+        return
+    for namespace in namespaces:
+        cache.pop(namespace, None)
 
 # ==================== 데이터베이스 함수 ====================
 def get_user_info():
@@ -465,36 +1407,61 @@ def get_user_info():
         return st.session_state.patient_name, st.session_state.patient_age
     return None, None
 
-def save_to_database(patient_name, patient_age, medicines, hospital, analysis, scan_date=None, user_id=None, medication_duration=1, medication_times=None, is_recurring=False, parent_record_id=None):
-    """Supabase에 저장 (복용 기간 지원)"""
+def build_record_row(patient_name, patient_age, medicines, hospital, analysis, scan_date=None, user_id=None, medication_duration=1, medication_times=None, is_recurring=False, parent_record_id=None, is_schedule=False, save_key=None):
+    """
+    medicine_records 테이블에 넣을 행 dict 생성
+    
+    save_key: 같은 저장을 다시 보내도 한 번만 들어가도록 앱에서 만든 키 (save_records_bulk용)
+    """
+    if scan_date is None:
+        scan_date = datetime.now().isoformat()
+    
+    # 종료일 계산
+    start_date = datetime.fromisoformat(scan_date) if isinstance(scan_date, str) else scan_date
+    end_date = start_date + timedelta(days=medication_duration - 1)
+    
+    return {
+        "patient_name": patient_name,
+        "patient_age": patient_age,
+        "medicines": medicines,
+        "hospital": hospital,
+        "analysis": analysis,
+        "scan_date": scan_date if isinstance(scan_date, str) else scan_date.isoformat(),
+        "created_at": datetime.now().isoformat(),
+        "user_id": user_id,
+        "taken": False,
+        "medication_duration": medication_duration,
+        "medication_times": medication_times if medication_times else [],
+        "end_date": end_date.isoformat(),
+        "is_recurring": is_recurring,
+        "parent_record_id": parent_record_id,
+        "is_schedule": is_schedule,
+        "save_key": save_key
+    }
+
+def save_to_database(patient_name, patient_age, medicines, hospital, analysis, scan_date=None, user_id=None, medication_duration=1, medication_times=None, is_recurring=False, parent_record_id=None, is_schedule=False):
+    """
+    Supabase에 저장 (복용 기간 지원)
+    
+    is_schedule=True면 복용 기간 전체를 나타내는 일정 기록 1개로 저장하고,
+    날짜별 복용 건은 조회 시 expand_occurrences로 펼칩니다.
+    """
     try:
-        if scan_date is None:
-            scan_date = datetime.now().isoformat()
-        
-        # 종료일 계산
-        start_date = datetime.fromisoformat(scan_date) if isinstance(scan_date, str) else scan_date
-        end_date = start_date + timedelta(days=medication_duration - 1)
-        
-        data = {
-            "patient_name": patient_name,
-            "patient_age": patient_age,
-            "medicines": medicines,
-            "hospital": hospital,
-            "analysis": analysis,
-            "scan_date": scan_date if isinstance(scan_date, str) else scan_date.isoformat(),
-            "created_at": datetime.now().isoformat(),
-            "user_id": user_id,
-            "taken": False,
-            "medication_duration": medication_duration,
-            "medication_times": medication_times if medication_times else [],
-            "end_date": end_date.isoformat(),
-            "is_recurring": is_recurring,
-            "parent_record_id": parent_record_id
-        }
+        data = build_record_row(
+            patient_name, patient_age, medicines, hospital, analysis,
+            scan_date=scan_date,
+            user_id=user_id,
+            medication_duration=medication_duration,
+            medication_times=medication_times,
+            is_recurring=is_recurring,
+            parent_record_id=parent_record_id,
+            is_schedule=is_schedule
+        )
         
         response = supabase.table('medicine_records').insert(data).execute()
+        invalidate_session_cache('records')
         
-        # 원본 레코드 ID 반환 (나중에 자동 생성에 사용)
+        # 저장된 레코드 ID 반환
         if response.data:
             return response.data[0]['id']
         return True
@@ -503,101 +1470,282 @@ def save_to_database(patient_name, patient_age, medicines, hospital, analysis, s
         st.error(f"❌ 저장 오류: {str(e)}")
         return None
 
-def create_recurring_records(patient_name, patient_age, medicines, hospital, analysis, start_date, user_id, medication_duration, medication_times, parent_record_id):
-    """복용 기간 동안 자동으로 기록 생성"""
-    try:
-        created_count = 0
-        
-        # 2일차부터 생성 (1일차는 이미 저장됨)
-        for day_offset in range(1, medication_duration):
-            record_date = start_date + timedelta(days=day_offset)
-            
-            # 자동 생성된 기록 저장
-            result = save_to_database(
-                patient_name=patient_name,
-                patient_age=patient_age,
-                medicines=medicines,
-                hospital=hospital,
-                analysis=analysis,
-                scan_date=record_date.isoformat(),
-                user_id=user_id,
-                medication_duration=medication_duration,
-                medication_times=medication_times,
-                is_recurring=True,  # 자동 생성 표시
-                parent_record_id=parent_record_id
-            )
-            
-            if result:
-                created_count += 1
-        
-        return created_count
-        
-    except Exception as e:
-        st.error(f"❌ 반복 기록 생성 오류: {str(e)}")
-        return 0
-
-def get_records_by_user(patient_name):
-    """특정 사용자의 모든 기록 가져오기"""
+def save_records_bulk(rows):
+    """
+    build_record_row로 만든 여러 기록을 요청 한 번으로 저장
+    
+    save_key로 upsert(중복 무시)하므로 응답을 못 받아 다시 저장하거나
+    새로고침 전에 저장 버튼을 두 번 눌러도 같은 일정이 두 번 들어가지 않습니다.
+    
+    Returns:
+        새로 저장된 레코드 ID 리스트 (이미 저장된 행은 빠짐, 실패 시 None)
+    """
     try:
         response = supabase.table('medicine_records')\
-            .select('*')\
-            .eq('patient_name', patient_name)\
-            .order('scan_date', desc=True)\
+            .upsert(rows, on_conflict='save_key', ignore_duplicates=True)\
             .execute()
-        return response.data
+        invalidate_session_cache('records')
+        return [row['id'] for row in response.data or []]
+        
     except Exception as e:
-        st.error(f"❌ 기록 조회 오류: {str(e)}")
+        st.error(f"❌ 저장 오류: {str(e)}")
+        return None
+
+# 목록/캘린더/현황에서 쓰는 컬럼 (큰 analysis JSON은 get_record_analysis로 따로 조회)
+RECORD_LIST_COLUMNS = 'id, patient_name, user_id, hospital, medicines, taken, scan_date, end_date, medication_duration, medication_times, is_schedule'
+RECORD_STATUS_COLUMNS = 'id, medicines, taken, scan_date, medication_duration, medication_times, is_schedule'
+RECORD_CALENDAR_COLUMNS = 'id, hospital, medicines, taken, scan_date, medication_duration, medication_times, is_schedule'
+RECORD_PAGE_SIZE = 50
+
+@session_cached('records', default=list, error_message="❌ 기록 조회 오류")
+def get_records_by_user(patient_name, columns=RECORD_LIST_COLUMNS, page_size=RECORD_PAGE_SIZE, before=None):
+    """
+    특정 사용자의 기록을 최신순으로 한 페이지 가져오기
+    
+    Args:
+        before: 이전 페이지 마지막 기록의 (scan_date, id). 없으면 첫 페이지
+    """
+    query = supabase.table('medicine_records')\
+        .select(columns)\
+        .eq('patient_name', patient_name)
+    if before:
+        # (scan_date, id) 기준 keyset 페이지네이션
+        last_scan_date, last_id = before
+        query = query.or_(f'scan_date.lt."{last_scan_date}",and(scan_date.eq."{last_scan_date}",id.lt.{last_id})')
+    response = query\
+        .order('scan_date', desc=True)\
+        .order('id', desc=True)\
+        .limit(page_size)\
+        .execute()
+    return response.data
+
+@session_cached('records', default=list, error_message="❌ 상세 정보 조회 오류")
+def get_record_analysis(record_id):
+    """기록 1개의 GPT 분석 결과(약 정보 리스트)만 가져오기"""
+    response = supabase.table('medicine_records')\
+        .select('analysis')\
+        .eq('id', record_id)\
+        .limit(1)\
+        .execute()
+    if not response.data:
         return []
+    analysis = response.data[0].get('analysis')
+    if isinstance(analysis, str):
+        analysis = json.loads(analysis) if analysis else []
+    return analysis if isinstance(analysis, list) else []
 
-def get_records_by_date(patient_name, date):
-    """특정 날짜의 기록 가져오기"""
-    try:
-        date_str = date.strftime('%Y-%m-%d')
-        response = supabase.table('medicine_records')\
-            .select('*')\
-            .eq('patient_name', patient_name)\
-            .gte('scan_date', f"{date_str}T00:00:00")\
-            .lt('scan_date', f"{date_str}T23:59:59")\
+def group_doses(rows):
+    """
+    medication_doses 행을 기록/날짜별로 묶기
+    
+    dose_time이 ''인 행은 그날 전체(제외 표시, 복용 시간 없는 기록의 복용 체크)입니다.
+    
+    Returns:
+        {(record_id, 'YYYY-MM-DD'): {'skipped': bool, 'taken_times': [복용 체크한 복용 시간]}}
+    """
+    doses = {}
+    for row in rows:
+        dose = doses.setdefault((row['record_id'], row['dose_date'][:10]), {'skipped': False, 'taken_times': []})
+        if row.get('skipped'):
+            dose['skipped'] = True
+        if row.get('taken'):
+            dose['taken_times'].append(row.get('dose_time') or '')
+    return doses
+
+def dose_slots(record):
+    """기록의 복용 시간 목록 (없으면 그날 전체를 뜻하는 '' 하나)"""
+    return list(record.get('medication_times') or []) or ['']
+
+def expand_occurrences(records, doses, start_date, end_date):
+    """
+    기록을 날짜별 복용 건으로 펼치기
+    
+    일정 기록(is_schedule)은 시작일부터 복용 기간 동안 매일 한 건씩,
+    예전 방식의 날짜별 기록은 scan_date 하루에 한 건으로 펼칩니다.
+    일정 기록의 taken은 그날 복용 시간을 모두 체크했을 때만 True입니다.
+    
+    Args:
+        records: medicine_records 행 리스트
+        doses: group_doses 결과
+        start_date, end_date: 조회 기간 (date, 양 끝 포함)
+    
+    Returns:
+        복용 건 리스트 (scan_date는 해당 날짜, occurrence_date/taken/taken_times는 그날 기준)
+    """
+    occurrences = []
+    for record in records:
+        scan_datetime = datetime.fromisoformat(record['scan_date'])
+        first_day = scan_datetime.date()
+        if record.get('is_schedule'):
+            last_day = first_day + timedelta(days=max(1, record.get('medication_duration') or 1) - 1)
+        else:
+            last_day = first_day
+        
+        day = max(first_day, start_date)
+        while day <= min(last_day, end_date):
+            dose = doses.get((record['id'], day.isoformat())) or {}
+            if not dose.get('skipped'):
+                occurrence = dict(record)
+                occurrence['scan_date'] = datetime.combine(day, scan_datetime.time()).isoformat()
+                occurrence['occurrence_date'] = day.isoformat()
+                if record.get('is_schedule'):
+                    taken_times = dose.get('taken_times') or []
+                    # '' 체크는 복용 시간별 체크 전에 날짜별로 한 번 체크한 기록
+                    if '' in taken_times:
+                        taken_times = dose_slots(record)
+                    occurrence['taken_times'] = [slot for slot in dose_slots(record) if slot in taken_times]
+                    occurrence['taken'] = len(occurrence['taken_times']) == len(dose_slots(record))
+                occurrences.append(occurrence)
+            day += timedelta(days=1)
+    
+    occurrences.sort(key=lambda occurrence: occurrence['scan_date'])
+    return occurrences
+
+def fetch_occurrences(column, value, start_date, end_date, columns=RECORD_LIST_COLUMNS):
+    """
+    기간 안의 날짜별 복용 건 조회 (실패 시 예외 발생)
+    
+    Args:
+        column, value: 필터 조건 (patient_name 또는 user_id)
+        start_date, end_date: 조회 기간 (date, 양 끝 포함)
+        columns: medicine_records에서 가져올 컬럼
+    """
+    range_start = f"{start_date}T00:00:00"
+    range_end = f"{end_date + timedelta(days=1)}T00:00:00"
+    
+    # 기간 안에 시작한 기록 + 기간 전에 시작했지만 아직 끝나지 않은 일정
+    response = supabase.table('medicine_records')\
+        .select(columns)\
+        .eq(column, value)\
+        .lt('scan_date', range_end)\
+        .or_(f"scan_date.gte.{range_start},and(is_schedule.eq.true,end_date.gte.{range_start})")\
+        .order('scan_date')\
+        .execute()
+    records = response.data or []
+    
+    doses = {}
+    schedule_ids = [record['id'] for record in records if record.get('is_schedule')]
+    if schedule_ids:
+        dose_response = supabase.table('medication_doses')\
+            .select('record_id, dose_date, dose_time, taken, skipped')\
+            .in_('record_id', schedule_ids)\
+            .gte('dose_date', start_date.isoformat())\
+            .lte('dose_date', end_date.isoformat())\
             .execute()
-        return response.data
-    except Exception as e:
-        st.error(f"❌ 날짜별 조회 오류: {str(e)}")
-        return []
+        doses = group_doses(dose_response.data or [])
+    
+    return expand_occurrences(records, doses, start_date, end_date)
+
+def count_records(patient_name):
+    """기록 수만 조회 (행 데이터 없이 count='exact' head 요청)"""
+    response = supabase.table('medicine_records')\
+        .select('id', count='exact', head=True)\
+        .eq('patient_name', patient_name)\
+        .execute()
+    return response.count or 0
+
+RECORD_STATS_COLUMNS = 'id, scan_date, medication_duration, is_schedule'
+
+@session_cached('records')
+def get_record_stats(patient_name):
+    """
+    사이드바 통계: (전체 처방 수, 최근 7일 동안 복용할 날이 있었던 처방 수)
+    
+    그 전에 시작해 아직 이어지는 일정도 세도록 scan_date가 아니라 날짜별 복용 건으로 셉니다.
+    """
+    today = datetime.now().date()
+    occurrences = fetch_occurrences('patient_name', patient_name, today - timedelta(days=6), today, columns=RECORD_STATS_COLUMNS)
+    return count_records(patient_name), len({occurrence['id'] for occurrence in occurrences})
 
-def delete_record(record_id):
-    """특정 기록 삭제"""
+@session_cached('records', default=list, error_message="❌ 기간별 조회 오류")
+def get_records_in_range(patient_name, start_date, end_date):
+    """기간 안의 날짜별 복용 건 가져오기"""
+    return fetch_occurrences('patient_name', patient_name, start_date, end_date)
+
+def delete_record(record_id, dose_date=None):
+    """
+    특정 기록 삭제
+    
+    dose_date가 있으면 일정 기록 중 그날 복용 건만 빼고 나머지 날짜는 유지합니다.
+    """
     try:
-        supabase.table('medicine_records').delete().eq('id', record_id).execute()
+        if dose_date:
+            supabase.table('medication_doses')\
+                .upsert({"record_id": record_id, "dose_date": dose_date, "dose_time": '', "skipped": True}, on_conflict='record_id,dose_date,dose_time')\
+                .execute()
+        else:
+            supabase.table('medicine_records').delete().eq('id', record_id).execute()
+        invalidate_session_cache('records')
         return True
     except Exception as e:
         st.error(f"❌ 삭제 오류: {str(e)}")
         return False
 
-def get_calendar_data(patient_name, year, month):
-    """특정 월의 처방 기록이 있는 날짜 리스트 반환"""
-    try:
-        start_date = f"{year}-{month:02d}-01T00:00:00"
-        if month == 12:
-            end_date = f"{year+1}-01-01T00:00:00"
-        else:
-            end_date = f"{year}-{month+1:02d}-01T00:00:00"
-        
-        response = supabase.table('medicine_records')\
-            .select('scan_date')\
-            .eq('patient_name', patient_name)\
-            .gte('scan_date', start_date)\
-            .lt('scan_date', end_date)\
-            .execute()
-        
-        dates_with_records = set()
-        for record in response.data:
-            date = datetime.fromisoformat(record['scan_date']).date()
-            dates_with_records.add(date.day)
-        
-        return dates_with_records
-    except Exception as e:
-        st.error(f"❌ 캘린더 데이터 조회 오류: {str(e)}")
-        return set()
+CALENDAR_WINDOW_TTL = 60 * 5  # 캘린더 구간을 다시 받기 전까지 유지하는 시간 (쓰기 시에는 바로 무효화)
+
+def build_day_index(occurrences):
+    """
+    복용 건을 날짜별 요약으로 묶기
+    
+    Returns:
+        {'YYYY-MM-DD': {'count', 'taken', 'untaken', 'medicines', 'records'}}
+    """
+    day_index = {}
+    for occurrence in occurrences:
+        day = day_index.setdefault(occurrence['scan_date'][:10], {
+            'count': 0, 'taken': 0, 'untaken': 0, 'medicines': [], 'records': []
+        })
+        day['count'] += 1
+        day['taken' if occurrence.get('taken') else 'untaken'] += 1
+        for medicine_name in occurrence.get('medicines') or []:
+            if medicine_name not in day['medicines']:
+                day['medicines'].append(medicine_name)
+        day['records'].append(occurrence)
+    return day_index
+
+def calendar_window(year, month):
+    """해당 월을 가운데로 한 3개월 구간 (전달 1일, 다음 달 말일)"""
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return (
+        datetime(prev_year, prev_month, 1).date(),
+        datetime(next_year, next_month, calendar.monthrange(next_year, next_month)[1]).date()
+    )
+
+@session_cached('records', default=dict, error_message="❌ 캘린더 데이터 조회 오류", ttl=CALENDAR_WINDOW_TTL)
+def get_calendar_window(patient_name, start_date, end_date):
+    """구간 전체를 한 번에 조회해서 날짜별 요약으로 반환"""
+    occurrences = fetch_occurrences(
+        'patient_name', patient_name, start_date, end_date,
+        columns=RECORD_CALENDAR_COLUMNS
+    )
+    return build_day_index(occurrences)
+
+def get_calendar_days(patient_name, year, month):
+    """
+    특정 월이 들어 있는 구간의 날짜별 요약
+    
+    이미 받아 둔 3개월 구간에 포함된 달이면 조회 없이 그 결과를 쓰므로,
+    앞뒤 달로 넘기거나 날짜를 고를 때는 네트워크 요청이 없습니다.
+    
+    Returns:
+        (구간 시작일, 구간 종료일, {'YYYY-MM-DD': 요약})
+    """
+    month_start = datetime(year, month, 1).date()
+    month_end = datetime(year, month, calendar.monthrange(year, month)[1]).date()
+    
+    for (cached_patient, start_date, end_date), cached_index in peek_session_cache('records', 'get_calendar_window'):
+        if cached_patient == patient_name and start_date <= month_start and month_end <= end_date:
+            return start_date, end_date, copy.deepcopy(cached_index)
+    
+    start_date, end_date = calendar_window(year, month)
+    return start_date, end_date, get_calendar_window(patient_name, start_date, end_date)
+
+def get_calendar_month(patient_name, year, month):
+    """특정 월의 날짜별 요약 ({'YYYY-MM-DD': 요약})"""
+    _, _, day_index = get_calendar_days(patient_name, year, month)
+    prefix = f"{year:04d}-{month:02d}-"
+    return {day: summary for day, summary in day_index.items() if day.startswith(prefix)}
 
 # ==================== 사용자 관리 함수 ====================
 def create_user(name, age, role, pin_code):
@@ -643,43 +1791,23 @@ def connect_family(parent_id, child_id):
     try:
         data = {"parent_id": parent_id, "child_id": child_id}
         supabase.table('family_connections').insert(data).execute()
+        invalidate_session_cache('family')
         return True
     except:
         return False
 
+@session_cached('family', default=list)
 def get_my_parents(child_id):
-    try:
-        response = supabase.table('family_connections')\
-            .select('parent_id, users!family_connections_parent_id_fkey(id, name, age)')\
-            .eq('child_id', child_id)\
-            .execute()
-        return response.data
-    except:
-        return []
-
-def get_my_children(parent_id):
-    """부모의 자녀 목록 가져오기"""
-    try:
-        response = supabase.table('family_connections')\
-            .select('child_id, users!family_connections_child_id_fkey(id, name)')\
-            .eq('parent_id', parent_id)\
-            .execute()
-        return response.data
-    except:
-        return []
+    response = supabase.table('family_connections')\
+        .select('parent_id, users!family_connections_parent_id_fkey(id, name, age)')\
+        .eq('child_id', child_id)\
+        .execute()
+    return response.data
 
+@session_cached('records', default=list)
 def get_today_medicine_status(user_id):
-    try:
-        today = datetime.now().date()
-        response = supabase.table('medicine_records')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .gte('scan_date', f"{today}T00:00:00")\
-            .lt('scan_date', f"{today}T23:59:59")\
-            .execute()
-        return response.data
-    except:
-        return []
+    today = datetime.now().date()
+    return fetch_occurrences('user_id', user_id, today, today, columns=RECORD_STATUS_COLUMNS)
 
 def link_old_records(patient_name, user_id):
     try:
@@ -688,179 +1816,619 @@ def link_old_records(patient_name, user_id):
             .eq('patient_name', patient_name)\
             .is_('user_id', 'null')\
             .execute()
+        invalidate_session_cache('records')
     except:
         pass
 
 # ==================== 🔔 알림 시스템 (텔레그램 + DB) ====================
+@st.cache_resource
+def get_notification_outbox():
+    """서버 프로세스당 알림 아웃박스 1개 (워커 스레드도 같이 시작, scheduler.py도 같은 워커를 돌림)"""
+    outbox = notifications.NotificationOutbox(
+        supabase,
+        bot_token=st.secrets.get("TELEGRAM_BOT_TOKEN"),
+        telegram_enabled=st.secrets.get("TELEGRAM_ENABLED", False),
+        worker_processes=st.secrets.get("TELEGRAM_WORKER_PROCESSES", notifications.TELEGRAM_WORKER_PROCESSES)
+    )
+    outbox.start()
+    return outbox
+
 def send_telegram_message(chat_id, message):
-    """텔레그램 메시지 전송"""
+    """텔레그램 메시지 바로 전송 (설정 테스트 메시지용, 알림은 아웃박스를 거침)"""
     try:
-        bot_token = st.secrets.get("TELEGRAM_BOT_TOKEN")
-        if not bot_token or not chat_id:
+        if not st.secrets.get("TELEGRAM_BOT_TOKEN") or not chat_id:
             return False
         
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        response = get_notification_outbox().post_telegram_message(chat_id, message)
+        return response.status_code == 200
+    except Exception as e:
+        print(f"텔레그램 전송 실패: {str(e)}")
+        return False
+
+def get_notification_settings(user_ids):
+    """사용자별 텔레그램 설정 조회 (캐시 + 한 번의 in_ 조회, 실패 시 예외 발생)"""
+    return get_notification_outbox().get_settings(user_ids)
+
+def invalidate_notification_settings(user_id):
+    """설정 저장 후 호출 (이 서버의 캐시에서 바로 제거)"""
+    get_notification_outbox().invalidate_settings(user_id)
+
+@session_cached('notifications', default=list)
+def get_unread_notifications(user_id):
+    """읽지 않은 알림 가져오기"""
+    response = supabase.table('notifications')\
+        .select('*')\
+        .eq('recipient_user_id', user_id)\
+        .eq('is_read', False)\
+        .order('created_at', desc=True)\
+        .execute()
+    return response.data
+
+def count_unread_notifications(user_id):
+    """읽지 않은 알림 수만 조회 (배지 새로고침용, 세션 캐시를 거치지 않음, 실패 시 예외 발생)"""
+    response = supabase.table('notifications')\
+        .select('id', count='exact', head=True)\
+        .eq('recipient_user_id', user_id)\
+        .eq('is_read', False)\
+        .execute()
+    return response.count or 0
+
+@session_cached('notifications', default=list)
+def get_all_notifications(user_id, limit=20):
+    """모든 알림 가져오기 (읽음/안읽음 모두)"""
+    response = supabase.table('notifications')\
+        .select('*')\
+        .eq('recipient_user_id', user_id)\
+        .order('created_at', desc=True)\
+        .limit(limit)\
+        .execute()
+    return response.data
+
+def mark_notification_as_read(notification_id):
+    """알림 읽음 처리"""
+    try:
+        supabase.table('notifications')\
+            .update({'is_read': True})\
+            .eq('id', notification_id)\
+            .execute()
+        invalidate_session_cache('notifications')
+        return True
+    except:
+        return False
+
+def mark_all_notifications_as_read(user_id):
+    """모든 알림 읽음 처리"""
+    try:
+        supabase.table('notifications')\
+            .update({'is_read': True})\
+            .eq('recipient_user_id', user_id)\
+            .eq('is_read', False)\
+            .execute()
+        invalidate_session_cache('notifications')
+        return True
+    except:
+        return False
+
+def send_medication_taken_notification(parent_name, medicines, parent_user_id, dose_time=''):
+    """복약 완료 알림을 자녀들에게 전송 (아웃박스 저장 실패 시 직접 호출, 실패 시 예외 발생)"""
+    get_notification_outbox().send_medication_taken_notification(parent_name, medicines, parent_user_id, dose_time)
+
+# ==================== 📮 알림 아웃박스 ====================
+def enqueue_notification_event(event_type, payload):
+    """알림 이벤트를 아웃박스에 넣고 워커를 깨움 (전달은 백그라운드에서)"""
+    get_notification_outbox().enqueue_event(event_type, payload)
+
+def mark_as_taken(record_id, parent_name, medicines, parent_user_id, dose_date=None, dose_time=''):
+    """
+    복약 완료 체크 + 자녀에게 알림 전송
+    
+    Args:
+        dose_date: 일정 기록의 복용 날짜
+        dose_time: 일정 기록의 복용 시간 (아침/점심/저녁, 복용 시간이 없는 기록은 '')
+    """
+    try:
+        # 복약 완료 처리 (taken_at은 timestamptz라 UTC 시각으로 저장)
+        if dose_date:
+            supabase.table('medication_doses')\
+                .upsert({
+                    "record_id": record_id,
+                    "dose_date": dose_date,
+                    "dose_time": dose_time or '',
+                    "taken": True,
+                    "taken_at": datetime.now(timezone.utc).isoformat()
+                }, on_conflict='record_id,dose_date,dose_time')\
+                .execute()
+        else:
+            supabase.table('medicine_records').update({'taken': True}).eq('id', record_id).execute()
+        invalidate_session_cache('records')
+        
+        # 자녀 알림은 아웃박스에 넣고 바로 반환 (전달은 백그라운드 워커)
+        payload = {"parent_name": parent_name, "medicines": medicines, "parent_user_id": parent_user_id, "dose_time": dose_time or ''}
+        try:
+            enqueue_notification_event('medication_taken', payload)
+        except Exception as e:
+            print(f"알림 아웃박스 저장 실패, 직접 전송: {str(e)}")
+            try:
+                send_medication_taken_notification(parent_name, medicines, parent_user_id, dose_time)
+            except Exception as e:
+                print(f"복약 완료 알림 전송 실패: {str(e)}")
+        
+        return True
+    except:
+        return False
+
+get_notification_outbox()
+
+# ==================== 🧵 스캔 작업 큐 ====================
+SCAN_JOB_WORKERS = int(st.secrets.get("SCAN_JOB_WORKERS", 4))  # 앱 전체에서 동시에 실행하는 스캔 작업 수
+SCAN_JOB_POLL_INTERVAL = 1.5  # 진행 상황 새로고침 간격 (초)
+SCAN_JOB_TTL = 60 * 60 * 24  # 끝난 작업 결과 보관 기간 (다시 접속한 화면이 가져갈 수 있도록)
+
+def run_scan(files, report=None):
+    """
+    약봉지 스캔 전체 실행: 분석 → 이름 보정 → 약봉지 간 중복 제거 → 약 정보 검색
+    (st.* 호출 없음, 스캔 작업 워커에서 실행)
+    
+    Args:
+        files: [(파일 이름, 파일 바이트)]
+        report: 진행 상황 콜백 report(진행률 0~1, 메시지, 부분 결과 dict 또는 None)
+    
+    Returns:
+        scan_result dict
+    """
+    report = report or (lambda progress, message, partial=None: None)
+    bags = []
+    scan_errors = []
+    cached_files = []
+    
+    report(0.05, f"📸 약봉지 {len(files)}개 분석 중...")
+    if len(files) == 1:
+        # 한 장이면 응답을 받는 대로 읽어낸 약 이름부터 보여줌
+        file_name, content = files[0]
+        
+        def show_recognized(partial):
+            names = [name for name in partial.get('medicines') or [] if isinstance(name, str) and name]
+            if names:
+                report(0.2, "🤖 AI가 약봉지를 분석하는 중...", {'recognized': names})
+        
+        try:
+            extracted_data, match, upload_stats = run_medicine_bag_analysis(
+                Image.open(io.BytesIO(content)),
+                on_partial=show_recognized,
+                original_bytes=len(content)
+            )
+            outcomes = [(extracted_data, upload_stats, match, None)]
+        except Exception as e:
+            outcomes = [(None, None, None, str(e))]
+    else:
+        outcomes = analyze_medicine_bags(
+            [(Image.open(io.BytesIO(content)), len(content)) for _, content in files],
+            on_done=lambda done, total: report(0.5 * done / total, f"📸 약봉지 분석 {done}/{total} 완료")
+        )
+    
+    for (file_name, _), (extracted_data, upload_stats, match, error) in zip(files, outcomes):
+        if not extracted_data:
+            scan_errors.append((file_name, error or "약 정보를 읽지 못했습니다"))
+            continue
+        if match:
+            cached_files.append(file_name)
+        bags.append({'file_name': file_name, 'extracted_data': extracted_data, 'upload_stats': upload_stats})
+    
+    if not bags:
+        raise RuntimeError(" / ".join(f"{file_name}: {error}" for file_name, error in scan_errors))
+    
+    # 저장은 약봉지에 적힌(OCR) 이름 그대로, 약 정보 검색/캐시 키로만 정식 제품명을 씀
+    for bag in bags:
+        bag['name_resolutions'] = resolve_medicine_names(bag['extracted_data'].get('medicines', []))
+        bag['medicines'] = [resolution['ocr'] for resolution in bag['name_resolutions']]
+        bag['lookup_names'] = [resolution['name'] for resolution in bag['name_resolutions']]
+    
+    # 여러 약봉지에 겹친 약은 한 번만 검색
+    medicines = merge_bag_medicines([bag['lookup_names'] for bag in bags])
+    cards = {}
+    report(0.5, f"🔍 약 {len(medicines)}개 정보 동시 검색 중...", {'medicines': medicines, 'cards': cards})
+    
+    def update_progress(done, total, medicine_name):
+        report(0.5 + 0.5 * done / total, f"✅ {medicine_name} 완료 ({done}/{total})")
+    
+    def show_partial_info(idx, partial_info):
+        # 배치 응답이 도착하는 대로 약별 카드를 채움
+        cards[idx] = partial_info
+        report(0.5, f"🔍 약 {len(medicines)}개 정보 받는 중...", {'medicines': medicines, 'cards': dict(cards)})
+    
+    medicine_infos, failures, token_stats = enrich_medicines(
+        medicines,
+        on_progress=update_progress,
+        on_partial=show_partial_info,
+        aligned=True
+    )
+    
+    info_by_key = {
+        normalize_medicine_key(medicine_name): info
+        for medicine_name, info in zip(medicines, medicine_infos) if info
+    }
+    for bag in bags:
+        bag_keys = dict.fromkeys(normalize_medicine_key(name) for name in bag['lookup_names'])
+        bag['all_medicine_info'] = [info_by_key[key] for key in bag_keys if key in info_by_key]
+    
+    return {
+        'bags': bags,
+        'scan_errors': scan_errors,
+        'cached_files': cached_files,
+        'failures': failures,
+        'token_stats': token_stats,
+        'duplicates_removed': sum(len(bag['lookup_names']) for bag in bags) - len(medicines)
+    }
+
+class ScanJobStore:
+    """스캔 작업 상태/결과 SQLite 저장소 (다시 접속하거나 앱이 재시작돼도 끝난 결과를 가져갈 수 있도록)"""
+
+    def __init__(self, path=CACHE_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+        except Exception as e:
+            print(f"스캔 작업 저장소 비활성화: {str(e)}")
+            self._conn = None
+
+    def save(self, job):
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO scan_jobs (job_id, status, state, updated_at) VALUES (?, ?, ?, ?)",
+                    (job['id'], job['status'], json.dumps(job, ensure_ascii=False), job['updated_at'])
+                )
+                self._conn.commit()
+        except Exception as e:
+            print(f"스캔 작업 저장 실패: {str(e)}")
+
+    def get(self, job_id):
+        if self._conn is None:
+            return None
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT state FROM scan_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return json.loads(row[0]) if row else None
+        except Exception as e:
+            print(f"스캔 작업 조회 실패: {str(e)}")
+            return None
+
+    def purge(self, older_than):
+        """오래된 작업 삭제"""
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute("DELETE FROM scan_jobs WHERE updated_at < ?", (older_than,))
+                self._conn.commit()
+        except Exception as e:
+            print(f"스캔 작업 정리 실패: {str(e)}")
+
+    def fail_unfinished(self, error):
+        """이전 프로세스에서 끝나지 못한 작업을 실패로 표시"""
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT state FROM scan_jobs WHERE status IN ('queued', 'running')"
+                ).fetchall()
+            for (state,) in rows:
+                job = json.loads(state)
+                job.update(status='failed', error=error, updated_at=time.time())
+                self.save(job)
+        except Exception as e:
+            print(f"스캔 작업 정리 실패: {str(e)}")
+
+class ScanJobManager:
+    """
+    스캔 작업 큐
+    
+    버튼을 누른 세션은 작업 ID만 받고, 분석은 워커 풀에서 실행됩니다.
+    진행 중 상태는 메모리에, 상태가 바뀔 때와 끝난 결과는 ScanJobStore에 저장합니다.
+    """
+
+    def __init__(self, store, max_workers=SCAN_JOB_WORKERS):
+        self._store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # 새 프로세스의 워커 풀에는 이전 작업이 없으므로 남아 있던 작업은 실패 처리
+        store.fail_unfinished("앱이 다시 시작되어 분석이 중단되었습니다. 다시 시도해주세요.")
+
+    def submit(self, owner, files):
+        """
+        스캔 작업 등록
+        
+        Args:
+            owner: 작업을 등록한 사용자 ID (다른 사용자가 결과를 가져가지 못하게 확인)
+            files: [(파일 이름, 파일 바이트)]
+        
+        Returns:
+            작업 ID
+        """
+        now = time.time()
+        self._store.purge(now - SCAN_JOB_TTL)
+        job = {
+            'id': hashlib.sha256(f"{owner}:{now}:{os.urandom(8).hex()}".encode()).hexdigest()[:16],
+            'owner': owner,
+            'status': 'queued',
+            'progress': 0.0,
+            'message': "⏳ 분석 대기 중...",
+            'partial': {},
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        with self._lock:
+            self._jobs[job['id']] = job
+        self._store.save(job)
+        self._executor.submit(self._run, job['id'], files)
+        return job['id']
+
+    def get(self, job_id):
+        """작업 상태 사본 (진행 중이면 메모리, 끝났으면 저장소에서)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return copy.deepcopy(job)
+        return self._store.get(job_id)
+
+    def _update(self, job_id, persist=False, **changes):
+        with self._lock:
+            job = self._jobs[job_id]
+            partial = changes.pop('partial', None)
+            if partial:
+                job['partial'].update(partial)
+            job.update(changes, updated_at=time.time())
+            snapshot = copy.deepcopy(job) if persist else None
+        if snapshot:
+            self._store.save(snapshot)
+
+    def _run(self, job_id, files):
+        self._update(job_id, persist=True, status='running', message="🤖 AI가 약봉지를 분석하는 중...")
+        
+        def report(progress, message, partial=None):
+            self._update(job_id, progress=progress, message=message, partial=partial)
         
-        # HTML 포맷으로 예쁘게 만들기
-        formatted_message = f"""<b>💊 복약 알림</b>
+        try:
+            result = run_scan(files, report)
+            # 저장 키: 같은 분석 결과를 여러 번 저장해도 한 번만 들어가도록 작업 ID로
+            result['save_key'] = job_id
+            self._update(job_id, persist=True, status='done', progress=1.0, message="✅ 분석 완료", result=result)
+        except Exception as e:
+            print(f"스캔 작업 실패 ({job_id}): {str(e)}")
+            self._update(job_id, persist=True, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._jobs.pop(job_id, None)
 
-{message}
+@st.cache_resource
+def get_scan_job_manager():
+    """앱 전체에서 공유하는 스캔 작업 큐"""
+    return ScanJobManager(ScanJobStore())
+
+def clear_scan_job():
+    """현재 세션의 스캔 작업 연결 해제"""
+    st.session_state.scan_job_id = None
+    st.query_params.pop('scan_job', None)
+
+@st.fragment(run_every=SCAN_JOB_POLL_INTERVAL)
+def scan_job_panel(job_id):
+    """스캔 작업 진행 상황 (이 부분만 주기적으로 다시 그림, 끝나면 결과를 세션에 넣고 전체 새로고침)"""
+    job = get_scan_job_manager().get(job_id)
+    if job is None or job['owner'] != st.session_state.user_id:
+        clear_scan_job()
+        st.rerun()
+    
+    if job['status'] == 'done':
+        st.session_state.scan_result = job['result']
+        clear_scan_job()
+        for file_name in job['result'].get('cached_files', []):
+            st.toast(f"⚡ {file_name}: 이전 분석 결과를 불러왔습니다")
+        st.rerun()
+    if job['status'] == 'failed':
+        st.session_state.scan_job_error = job['error']
+        clear_scan_job()
+        st.rerun()
+    
+    st.progress(job['progress'], text=job['message'])
+    partial = job['partial']
+    if partial.get('recognized') and not partial.get('medicines'):
+        st.markdown(f"📋 인식된 약: {', '.join(partial['recognized'])}")
+    
+    cards = partial.get('cards', {})
+    for idx, medicine_name in enumerate(partial.get('medicines', [])):
+        partial_info = cards.get(idx) or cards.get(str(idx))
+        if not partial_info:
+            continue
+        lines = [f"**💊 {partial_info.get('약품명') or medicine_name}**"]
+        for label, field in (("효능", '효능효과'), ("복용법", '용법용량'), ("주의사항", '주의사항')):
+            if partial_info.get(field):
+                lines.append(f"{label}: {partial_info[field]}")
+        st.markdown("  \n".join(lines))
+    st.caption("분석은 서버에서 계속 진행됩니다. 화면을 새로고침하거나 다시 접속해도 결과를 이어서 받을 수 있습니다.")
+
+# ==================== 📅 캘린더 컴포넌트 ====================
+_medication_calendar = components.declare_component(
+    "medication_calendar",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "calendar")
+)
 
-<i>우리 가족 스마트 복약 관리</i>"""
-        
-        data = {
-            "chat_id": chat_id,
-            "text": formatted_message,
-            "parse_mode": "HTML"
-        }
-        
-        response = requests.post(url, json=data, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        print(f"텔레그램 전송 실패: {str(e)}")
-        return False
+def medication_calendar(year, month, window_start, window_end, day_index, selected=None, key=None):
+    """
+    복약 캘린더 (HTML 위젯 하나로 그림)
+    
+    구간 안의 달 이동은 브라우저에서 처리하고, 날짜를 누르거나 구간 밖 달로 넘길 때만
+    값을 돌려줘 다시 실행됩니다.
+    
+    Returns:
+        {'date': 'YYYY-MM-DD', 'nonce'} 또는 {'month': 'YYYY-MM', 'nonce'} 또는 None
+    """
+    # 상세 기록은 빼고 점/개수/툴팁에 필요한 요약만 전달
+    days = {
+        day: {field: summary[field] for field in ('count', 'taken', 'untaken', 'medicines')}
+        for day, summary in day_index.items()
+    }
+    return _medication_calendar(
+        year=year,
+        month=month,
+        window_start=window_start.strftime('%Y-%m'),
+        window_end=window_end.strftime('%Y-%m'),
+        days=days,
+        today=datetime.now().date().isoformat(),
+        selected=selected.isoformat() if selected else None,
+        key=key,
+        default=None
+    )
 
+# ==================== 🧩 화면 영역 (fragment) ====================
+NOTIFICATION_POLL_INTERVAL = 30  # 읽지 않은 알림 배지 새로고침 간격 (초)
 
-def send_notification(recipient_user_id, message, notification_type="medication"):
+@st.fragment(run_every=NOTIFICATION_POLL_INTERVAL)
+def unread_badge():
     """
-    알림 전송 (DB + 텔레그램)
+    사이드바 읽지 않은 알림 배지 (알림 탭에서 읽음 처리하면 다음 새로고침 때 반영)
     
-    Args:
-        recipient_user_id: 수신자 user_id
-        message: 알림 메시지
-        notification_type: 알림 종류 (medication, reminder 등)
+    세션 캐시(SESSION_CACHE_TTL)보다 자주 새로고침하므로 매번 개수만 새로 조회하고,
+    캐시된 알림 목록과 개수가 다르면 알림 캐시를 비워 알림 탭도 새 목록을 받게 합니다.
     """
     try:
-        # 1. DB에 알림 저장 (무조건 실행)
-        data = {
-            "recipient_user_id": recipient_user_id,
-            "message": message,
-            "notification_type": notification_type,
-            "is_read": False,
-            "created_at": datetime.now().isoformat()
-        }
-        supabase.table('notifications').insert(data).execute()
-        
-        # 2. 텔레그램 알림 (활성화된 경우)
-        if st.secrets.get("TELEGRAM_ENABLED", False):
-            try:
-                # 사용자 설정에서 chat_id 가져오기
-                user_settings = supabase.table('user_notification_settings')\
-                    .select('telegram_chat_id, telegram_enabled')\
-                    .eq('user_id', recipient_user_id)\
-                    .execute()
-                
-                if user_settings.data and len(user_settings.data) > 0:
-                    settings = user_settings.data[0]
-                    if settings.get('telegram_enabled'):
-                        chat_id = settings.get('telegram_chat_id')
-                        if chat_id:
-                            send_telegram_message(chat_id, message)
-            except Exception as e:
-                # 텔레그램 실패해도 DB 알림은 정상 작동
-                print(f"텔레그램 알림 실패: {str(e)}")
-        
-        return True
-    except Exception as e:
-        st.error(f"알림 전송 실패: {str(e)}")
-        return False
-
-def get_unread_notifications(user_id):
-    """읽지 않은 알림 가져오기"""
+        unread_count = count_unread_notifications(st.session_state.user_id)
+    except Exception:
+        return
+    for (user_id,), cached in peek_session_cache('notifications', 'get_unread_notifications'):
+        if user_id == st.session_state.user_id and len(cached) != unread_count:
+            invalidate_session_cache('notifications')
+            break
+    if unread_count > 0:
+        st.warning(f"🔔 읽지 않은 알림 {unread_count}개")
+
+@st.fragment
+def sidebar_stats():
+    """사이드바 복약 통계"""
+    st.markdown("## 📊 나의 복약 통계")
     try:
-        response = supabase.table('notifications')\
-            .select('*')\
-            .eq('recipient_user_id', user_id)\
-            .eq('is_read', False)\
-            .order('created_at', desc=True)\
-            .execute()
-        return response.data
+        total_count, week_count = get_record_stats(st.session_state.patient_name)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("총 처방", f"{total_count}건", help="전체 처방 기록")
+        with col2:
+            st.metric("이번 주", f"{week_count}건", help="최근 7일 동안 복용한 처방 (이어지는 일정 포함)")
     except:
-        return []
+        st.metric("총 처방", "0건")
 
-def get_all_notifications(user_id, limit=20):
-    """모든 알림 가져오기 (읽음/안읽음 모두)"""
+@st.fragment
+def telegram_settings_panel():
+    """사이드바 텔레그램 알림 설정 (입력/저장은 이 영역만 다시 실행)"""
+    st.divider()
+    st.markdown("## 📱 텔레그램 알림 설정")
+    
+    # 현재 설정 조회
     try:
-        response = supabase.table('notifications')\
-            .select('*')\
-            .eq('recipient_user_id', user_id)\
-            .order('created_at', desc=True)\
-            .limit(limit)\
-            .execute()
-        return response.data
-    except:
-        return []
+        settings = get_notification_settings([st.session_state.user_id])[st.session_state.user_id] or {}
+        
+        current_chat_id = settings.get('telegram_chat_id') or ''
+        telegram_enabled = settings.get('telegram_enabled', False)
+        
+        # 설정 방법 안내
+        with st.expander("📖 설정 방법 보기", expanded=not current_chat_id):
+            st.markdown("""
+### 텔레그램 알림 설정 방법
 
-def mark_notification_as_read(notification_id):
-    """알림 읽음 처리"""
-    try:
-        supabase.table('notifications')\
-            .update({'is_read': True})\
-            .eq('id', notification_id)\
-            .execute()
-        return True
-    except:
-        return False
+1. **텔레그램 앱 설치** (스마트폰 or PC)
 
-def mark_all_notifications_as_read(user_id):
-    """모든 알림 읽음 처리"""
-    try:
-        supabase.table('notifications')\
-            .update({'is_read': True})\
-            .eq('recipient_user_id', user_id)\
-            .eq('is_read', False)\
-            .execute()
-        return True
-    except:
-        return False
+2. **봇과 대화 시작**
+   - 텔레그램에서 봇 검색: `@your_medication_bot`
+   - 대화 시작 버튼 클릭
+   - 아무 메시지나 보내기 (예: "안녕")
 
-def send_medication_taken_notification(parent_name, medicines, parent_user_id):
-    """복약 완료 알림을 자녀들에게 전송"""
-    try:
-        # 자녀 목록 가져오기
-        children = get_my_children(parent_user_id)
+3. **Chat ID 받기**
+   - 회원님께만 알려드립니다➳♡
+   ```
+   8145800698
+   ```
+
+4. **아래에 Chat ID 입력하고 저장**
+
+💡 **Chat ID는 숫자로만 이루어져 있습니다** (예: 123456789)
+            """)
         
-        if not children:
-            return
+        # Chat ID 입력
+        chat_id = st.text_input(
+            "텔레그램 Chat ID",
+            value=current_chat_id,
+            placeholder="123456789",
+            help="봇과 대화를 시작한 후 받은 Chat ID를 입력하세요"
+        )
         
-        # 약 이름 포맷팅
-        medicine_list = ", ".join(medicines[:3])
-        if len(medicines) > 3:
-            medicine_list += f" 외 {len(medicines)-3}개"
-        
-        # 메시지 생성 (한국 시간 KST)
-        kst = timezone(timedelta(hours=9))
-        current_time = datetime.now(kst).strftime('%H:%M')
-        message = f"💊 {parent_name}님이 방금 약을 복용하셨습니다.\n📋 복용약: {medicine_list}"
-        
-        # 각 자녀에게 알림 전송
-        for child_data in children:
-            child_info = child_data.get('users', {})
-            if isinstance(child_info, dict):
-                child_id = child_info.get('id')
+        # 알림 활성화 스위치
+        telegram_switch = st.checkbox(
+            "📢 텔레그램 알림 받기", 
+            value=telegram_enabled,
+            help="부모님이 약을 드시면 텔레그램으로 즉시 알림이 옵니다"
+        )
+        
+        # 저장 버튼
+        if st.button("💾 텔레그램 설정 저장", use_container_width=True, type="primary"):
+            if chat_id and chat_id.strip().replace('-', '').isdigit():
+                try:
+                    upsert_data = {
+                        "user_id": st.session_state.user_id,
+                        "telegram_chat_id": chat_id.strip(),
+                        "telegram_enabled": telegram_switch,
+                        "updated_at": datetime.now().isoformat()
+                    }
+                    
+                    supabase.table('user_notification_settings')\
+                        .upsert(upsert_data)\
+                        .execute()
+                    invalidate_notification_settings(st.session_state.user_id)
+                    
+                    st.success("✅ 텔레그램 설정이 저장되었습니다!")
+                    
+                    # 테스트 메시지 전송
+                    if telegram_switch and st.secrets.get("TELEGRAM_ENABLED", False):
+                        test_msg = f"🎉 {st.session_state.patient_name}님, 텔레그램 알림이 설정되었습니다!\n\n부모님이 약을 드시면 이런 식으로 알림이 옵니다."
+                        if send_telegram_message(chat_id.strip(), test_msg):
+                            st.success("✅ 테스트 메시지가 전송되었습니다! 텔레그램을 확인해보세요 📱")
+                        else:
+                            st.warning("⚠️ 테스트 메시지 전송 실패. Chat ID를 다시 확인해주세요.")
+                    
+                    time.sleep(1)
+                    st.rerun(scope="fragment")
+                except Exception as e:
+                    st.error(f"저장 실패: {str(e)}")
+            elif chat_id:
+                st.error("❌ 올바른 Chat ID를 입력하세요 (숫자만 가능)")
             else:
-                child_id = child_data.get('child_id')
-            
-            if child_id:
-                send_notification(child_id, message, "medication")
+                st.warning("⚠️ Chat ID를 입력해주세요")
         
-        return True
+        # 현재 상태 표시
+        if telegram_enabled and current_chat_id:
+            st.success("✅ 텔레그램 알림이 활성화되어 있습니다")
+        elif current_chat_id:
+            st.info("ℹ️ Chat ID는 저장되었지만 알림이 비활성화되어 있습니다")
+        else:
+            st.info("ℹ️ 텔레그램 알림을 설정하면 실시간으로 알림을 받을 수 있습니다")
+            
     except Exception as e:
-        st.error(f"알림 전송 실패: {str(e)}")
-        return False
-
-def mark_as_taken(record_id, parent_name, medicines, parent_user_id):
-    """복약 완료 체크 + 자녀에게 알림 전송"""
-    try:
-        # 복약 완료 처리
-        supabase.table('medicine_records').update({'taken': True}).eq('id', record_id).execute()
-        
-        # 자녀들에게 알림 전송
-        send_medication_taken_notification(parent_name, medicines, parent_user_id)
-        
-        return True
-    except:
-        return False
+        st.error(f"설정 조회 오류: {str(e)}")
 
 # ==================== 메인 타이틀 ====================
 st.markdown('<h1 class="main-title">♥ 우리가족 스마트 복약 관리 MediMate ♥</h1>', unsafe_allow_html=True)
@@ -893,15 +2461,15 @@ with st.sidebar:
         
         # 자녀 모드일 경우 읽지 않은 알림 표시
         if user_role == "자녀":
-            unread_count = len(get_unread_notifications(st.session_state.user_id))
-            if unread_count > 0:
-                st.warning(f"🔔 읽지 않은 알림 {unread_count}개")
+            unread_badge()
         
         # 로그아웃 버튼
         if st.button("🚪 로그아웃", use_container_width=True):
             st.session_state.logged_in = False
             st.session_state.user_id = None
             st.session_state.patient_name = ""
+            st.session_state.pop('_query_cache', None)
+            clear_scan_job()
             st.rerun()
     
     # ==================== 로그인/회원가입 화면 ====================
@@ -1031,129 +2599,11 @@ with st.sidebar:
     
     # 사용자별 통계 (로그인 상태일 때만 표시)
     if st.session_state.logged_in and st.session_state.patient_name:
-        st.markdown("## 📊 나의 복약 통계")
-        try:
-            all_records = get_records_by_user(st.session_state.patient_name)
-            total_count = len(all_records)
-            
-            today = datetime.now().date()
-            today_records = [r for r in all_records if datetime.fromisoformat(r.get('scan_date', '')).date() == today]
-            today_count = len(today_records)
-            
-            # 최근 7일 통계
-            week_ago = today - timedelta(days=7)
-            week_records = [r for r in all_records if datetime.fromisoformat(r.get('scan_date', '')).date() >= week_ago]
-            week_count = len(week_records)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("총 처방", f"{total_count}건", help="전체 처방 기록")
-            with col2:
-                st.metric("이번 주", f"{week_count}건", help="최근 7일 기록")
-        except:
-            st.metric("총 처방", "0건")
+        sidebar_stats()
     
     # 텔레그램 설정 (자녀 모드만, 로그인 상태)
     if st.session_state.logged_in and st.session_state.user_id and st.session_state.user_role == "자녀":
-        st.divider()
-        st.markdown("## 📱 텔레그램 알림 설정")
-        
-        # 현재 설정 조회
-        try:
-            settings = supabase.table('user_notification_settings')\
-                .select('*')\
-                .eq('user_id', st.session_state.user_id)\
-                .execute()
-            
-            current_chat_id = ""
-            telegram_enabled = False
-            
-            if settings.data and len(settings.data) > 0:
-                current_chat_id = settings.data[0].get('telegram_chat_id', '')
-                telegram_enabled = settings.data[0].get('telegram_enabled', False)
-            
-            # 설정 방법 안내
-            with st.expander("📖 설정 방법 보기", expanded=not current_chat_id):
-                st.markdown("""
-### 텔레그램 알림 설정 방법
-
-1. **텔레그램 앱 설치** (스마트폰 or PC)
-
-2. **봇과 대화 시작**
-   - 텔레그램에서 봇 검색: `@your_medication_bot`
-   - 대화 시작 버튼 클릭
-   - 아무 메시지나 보내기 (예: "안녕")
-
-3. **Chat ID 받기**
-   - 회원님께만 알려드립니다➳♡
-   ```
-   8145800698
-   ```
-
-4. **아래에 Chat ID 입력하고 저장**
-
-💡 **Chat ID는 숫자로만 이루어져 있습니다** (예: 123456789)
-                """)
-            
-            # Chat ID 입력
-            chat_id = st.text_input(
-                "텔레그램 Chat ID",
-                value=current_chat_id,
-                placeholder="123456789",
-                help="봇과 대화를 시작한 후 받은 Chat ID를 입력하세요"
-            )
-            
-            # 알림 활성화 스위치
-            telegram_switch = st.checkbox(
-                "📢 텔레그램 알림 받기", 
-                value=telegram_enabled,
-                help="부모님이 약을 드시면 텔레그램으로 즉시 알림이 옵니다"
-            )
-            
-            # 저장 버튼
-            if st.button("💾 텔레그램 설정 저장", use_container_width=True, type="primary"):
-                if chat_id and chat_id.strip().replace('-', '').isdigit():
-                    try:
-                        upsert_data = {
-                            "user_id": st.session_state.user_id,
-                            "telegram_chat_id": chat_id.strip(),
-                            "telegram_enabled": telegram_switch,
-                            "updated_at": datetime.now().isoformat()
-                        }
-                        
-                        supabase.table('user_notification_settings')\
-                            .upsert(upsert_data)\
-                            .execute()
-                        
-                        st.success("✅ 텔레그램 설정이 저장되었습니다!")
-                        
-                        # 테스트 메시지 전송
-                        if telegram_switch and st.secrets.get("TELEGRAM_ENABLED", False):
-                            test_msg = f"🎉 {st.session_state.patient_name}님, 텔레그램 알림이 설정되었습니다!\n\n부모님이 약을 드시면 이런 식으로 알림이 옵니다."
-                            if send_telegram_message(chat_id.strip(), test_msg):
-                                st.success("✅ 테스트 메시지가 전송되었습니다! 텔레그램을 확인해보세요 📱")
-                            else:
-                                st.warning("⚠️ 테스트 메시지 전송 실패. Chat ID를 다시 확인해주세요.")
-                        
-                        time.sleep(1)
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"저장 실패: {str(e)}")
-                elif chat_id:
-                    st.error("❌ 올바른 Chat ID를 입력하세요 (숫자만 가능)")
-                else:
-                    st.warning("⚠️ Chat ID를 입력해주세요")
-            
-            # 현재 상태 표시
-            if telegram_enabled and current_chat_id:
-                st.success("✅ 텔레그램 알림이 활성화되어 있습니다")
-            elif current_chat_id:
-                st.info("ℹ️ Chat ID는 저장되었지만 알림이 비활성화되어 있습니다")
-            else:
-                st.info("ℹ️ 텔레그램 알림을 설정하면 실시간으로 알림을 받을 수 있습니다")
-                
-        except Exception as e:
-            st.error(f"설정 조회 오류: {str(e)}")
+        telegram_settings_panel()
     
     st.divider()
 
@@ -1166,7 +2616,9 @@ elif st.session_state.user_role == "부모님":
     tab1, tab2, tab3 = st.tabs(["🏥 처방약 스캔", "💬 약 검색 챗봇", "📅 복약 캘린더"])
     
     # ==================== 탭1: 처방약 스캔 ====================
-    with tab1:
+    # 탭마다 fragment로 나눠서 한 탭 안의 클릭은 그 탭만 다시 실행
+    @st.fragment
+    def scan_panel():
         st.markdown("## 📸 약봉지 사진 분석")
         st.markdown("처방받은 약봉지를 업로드하면 AI가 자동으로 약 이름을 추출하고 정보를 제공합니다.")
         
@@ -1180,187 +2632,217 @@ elif st.session_state.user_role == "부모님":
         
         st.divider()
         
-        uploaded_file = st.file_uploader(
+        uploaded_files = st.file_uploader(
             "약봉지 사진을 업로드하세요",
             type=['png', 'jpg', 'jpeg'],
-            help="약 이름이 선명하게 보이는 사진을 업로드해주세요"
+            accept_multiple_files=True,
+            help="약 이름이 선명하게 보이는 사진을 업로드해주세요. 약봉지가 여러 개면 한 번에 올려도 됩니다"
         )
         
         if 'scan_result' not in st.session_state:
             st.session_state.scan_result = None
         if 'scan_img_id' not in st.session_state:
             st.session_state.scan_img_id = None
+        if 'scan_job_id' not in st.session_state:
+            # 새로고침/재접속한 화면은 주소의 작업 ID로 진행 중인 분석을 이어받음
+            st.session_state.scan_job_id = st.query_params.get('scan_job')
 
-        if uploaded_file:
-            if st.session_state.scan_img_id != uploaded_file.file_id:
+        if uploaded_files:
+            upload_ids = [uploaded_file.file_id for uploaded_file in uploaded_files]
+            if st.session_state.scan_img_id != upload_ids:
                 st.session_state.scan_result = None
-                st.session_state.scan_img_id = uploaded_file.file_id
+                st.session_state.scan_img_id = upload_ids
 
-            image = Image.open(uploaded_file)
-            st.image(image, caption="업로드된 약봉지", width=400)
+            images = [Image.open(uploaded_file) for uploaded_file in uploaded_files]
+            if len(images) == 1:
+                st.image(images[0], caption="업로드된 약봉지", width=400)
+            else:
+                st.image(images, caption=[uploaded_file.name for uploaded_file in uploaded_files], width=200)
             
-            if st.button("🔍 AI 분석 시작", type="primary", use_container_width=True):
-                with st.spinner("🤖 AI가 약봉지를 분석하는 중..."):
-                    extracted_data = analyze_medicine_bag(image)
-                    
-                    if extracted_data:
-                        medicines = extracted_data.get('medicines', [])
-                        
-                        all_medicine_info = []
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        
-                        for idx, medicine_name in enumerate(medicines):
-                            status_text.text(f"🔍 {medicine_name} 정보 검색 중...")
-                            progress_bar.progress((idx + 1) / len(medicines))
-                            medicine_info = search_medicine_info_gpt(medicine_name)
-                            if medicine_info:
-                                all_medicine_info.append(medicine_info)
-                        
-                        progress_bar.empty()
-                        status_text.empty()
-                        
-                        st.session_state.scan_result = {
-                            'extracted_data': extracted_data,
-                            'medicines': medicines,
-                            'all_medicine_info': all_medicine_info
-                        }
-                        st.rerun()
-                    else:
-                        st.error("❌ 이미지 분석 실패. 다시 시도해주세요.")
+            # 분석 중에는 다시 눌러도 작업이 중복으로 등록되지 않도록 비활성화
+            if st.button("🔍 AI 분석 시작", type="primary", use_container_width=True, disabled=bool(st.session_state.scan_job_id)):
+                job_id = get_scan_job_manager().submit(
+                    st.session_state.user_id,
+                    [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+                )
+                st.session_state.scan_job_id = job_id
+                st.query_params['scan_job'] = job_id
+                st.session_state.scan_result = None
+                st.rerun(scope="fragment")
+
+        if st.session_state.scan_job_id:
+            scan_job_panel(st.session_state.scan_job_id)
+
+        scan_job_error = st.session_state.pop('scan_job_error', None)
+        if scan_job_error:
+            st.error(f"❌ 이미지 분석 실패: {scan_job_error}")
 
         if st.session_state.scan_result:
             result = st.session_state.scan_result
-            extracted_data = result['extracted_data']
-            medicines = result['medicines']
-            all_medicine_info = result['all_medicine_info']
+            bags = result['bags']
 
             st.markdown('<div class="success-box">✅ 분석 완료!</div>', unsafe_allow_html=True)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.info(f"**🏥 병원:** {extracted_data.get('hospital', '정보 없음')}")
-            with col2:
-                st.info(f"**📅 인식된 날짜:** {extracted_data.get('date', '정보 없음')}")
-
-            for info in all_medicine_info:
-                with st.expander(f"💊 {info['약품명']}"):
-                    st.write(f"효능: {info.get('효능효과', '-')}")
-                    st.write(f"복용법: {info.get('용법용량', '-')}")
-                    st.write(f"주의사항: {info.get('주의사항', '-')}")
 
-            st.divider()
-            st.markdown("### 💊 복용 정보 입력")
+            for file_name, error in result.get('scan_errors', []):
+                st.warning(f"⚠️ {file_name} 분석 실패: {error}")
 
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # 날짜 선택
-                ai_date = extracted_data.get('date', '')
-                parsed_date = parse_flexible_date(ai_date)
-                default_date = parsed_date if parsed_date else datetime.now().date()
-
-                final_date = st.date_input(
-                    "📅 시작일", 
-                    value=default_date,
-                    help="복용 시작 날짜"
+            for medicine_name, error in result.get('failures', []):
+                st.warning(f"⚠️ {medicine_name} 정보 검색 실패: {error}")
+
+            token_stats = result.get('token_stats')
+            if token_stats and token_stats['api_calls']:
+                st.caption(
+                    f"🧮 GPT 호출 {token_stats['api_calls']}회 · 프롬프트 토큰 {token_stats['prompt_tokens']} "
+                    f"(약별 개별 호출 대비 약 {token_stats['tokens_saved']} 토큰 절약)"
                 )
-            
-            with col2:
-                # 복용 기간 선택
-                duration_options = {
-                    "1일 (오늘만)": 1,
-                    "3일": 3,
-                    "5일": 5,
-                    "7일 (1주일)": 7,
-                    "14일 (2주일)": 14,
-                    "30일 (1개월)": 30,
-                    "직접 입력": 0
-                }
+            if result.get('duplicates_removed'):
+                st.caption(f"🔁 여러 약봉지에 겹친 약 {result['duplicates_removed']}개는 한 번만 검색했습니다")
+
+            schedules = []
+            for bag_idx, bag in enumerate(bags):
+                extracted_data = bag['extracted_data']
                 
-                duration_choice = st.selectbox(
-                    "📆 복용 기간",
-                    options=list(duration_options.keys()),
-                    index=2,  # 기본값: 5일
-                    help="약을 며칠 동안 복용하시나요?"
-                )
+                if len(bags) > 1:
+                    st.divider()
+                    st.markdown(f"### 🧾 약봉지 {bag_idx + 1}: {bag['file_name']}")
                 
-                medication_duration = duration_options[duration_choice]
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.info(f"**🏥 병원:** {extracted_data.get('hospital', '정보 없음')}")
+                with col2:
+                    st.info(f"**📅 인식된 날짜:** {extracted_data.get('date', '정보 없음')}")
+
+                for resolution in bag.get('name_resolutions', []):
+                    if resolution['corrected'] and resolution['ocr'] != resolution['name']:
+                        st.caption(
+                            f"🔎 {resolution['ocr']}: **{resolution['name']}** 정보로 검색 "
+                            f"(신뢰도 {resolution['confidence']:.0%})"
+                        )
+
+                upload_stats = bag.get('upload_stats')
+                if upload_stats:
+                    st.caption(
+                        f"📦 전송 이미지 {upload_stats['bytes'] / 1024:.0f}KB "
+                        f"(원본 대비 {upload_stats['bytes_saved'] / 1024:.0f}KB 절약) · "
+                        f"Vision 토큰 {upload_stats['tokens']} ({upload_stats['tokens_saved']} 절약)"
+                    )
+
+                for info in bag['all_medicine_info']:
+                    with st.expander(f"💊 {info['약품명']}"):
+                        st.write(f"효능: {info.get('효능효과', '-')}")
+                        st.write(f"복용법: {info.get('용법용량', '-')}")
+                        st.write(f"주의사항: {info.get('주의사항', '-')}")
+
+                if len(bags) == 1:
+                    st.divider()
+                st.markdown("#### 💊 복용 정보 입력" if len(bags) > 1 else "### 💊 복용 정보 입력")
+
+                col1, col2 = st.columns(2)
                 
-                # 직접 입력 선택 시
-                if medication_duration == 0:
-                    medication_duration = st.number_input(
-                        "일수 입력",
-                        min_value=1,
-                        max_value=90,
-                        value=7,
-                        help="1~90일 사이로 입력하세요"
+                with col1:
+                    # 날짜 선택
+                    ai_date = extracted_data.get('date', '')
+                    parsed_date = parse_flexible_date(ai_date)
+                    default_date = parsed_date if parsed_date else datetime.now().date()
+
+                    final_date = st.date_input(
+                        "📅 시작일", 
+                        value=default_date,
+                        help="복용 시작 날짜",
+                        key=f"scan_start_{bag_idx}"
                     )
-            
-            # 복용 시간 선택
-            st.markdown("#### ⏰ 복용 시간")
-            time_cols = st.columns(3)
-            
-            medication_times = []
-            with time_cols[0]:
-                if st.checkbox("🌅 아침", value=True):
-                    medication_times.append("아침")
-            with time_cols[1]:
-                if st.checkbox("🌞 점심", value=False):
-                    medication_times.append("점심")
-            with time_cols[2]:
-                if st.checkbox("🌙 저녁", value=True):
-                    medication_times.append("저녁")
-            
-            # 요약 정보 표시
-            end_date = final_date + timedelta(days=medication_duration - 1)
-            st.info(f"""
+                
+                with col2:
+                    # 복용 기간 선택
+                    duration_options = {
+                        "1일 (오늘만)": 1,
+                        "3일": 3,
+                        "5일": 5,
+                        "7일 (1주일)": 7,
+                        "14일 (2주일)": 14,
+                        "30일 (1개월)": 30,
+                        "직접 입력": 0
+                    }
+                    
+                    duration_choice = st.selectbox(
+                        "📆 복용 기간",
+                        options=list(duration_options.keys()),
+                        index=2,  # 기본값: 5일
+                        help="약을 며칠 동안 복용하시나요?",
+                        key=f"scan_duration_{bag_idx}"
+                    )
+                    
+                    medication_duration = duration_options[duration_choice]
+                    
+                    # 직접 입력 선택 시
+                    if medication_duration == 0:
+                        medication_duration = st.number_input(
+                            "일수 입력",
+                            min_value=1,
+                            max_value=90,
+                            value=7,
+                            help="1~90일 사이로 입력하세요",
+                            key=f"scan_duration_days_{bag_idx}"
+                        )
+                
+                # 복용 시간 선택
+                st.markdown("#### ⏰ 복용 시간")
+                time_cols = st.columns(3)
+                
+                medication_times = []
+                with time_cols[0]:
+                    if st.checkbox("🌅 아침", value=True, key=f"scan_morning_{bag_idx}"):
+                        medication_times.append("아침")
+                with time_cols[1]:
+                    if st.checkbox("🌞 점심", value=False, key=f"scan_lunch_{bag_idx}"):
+                        medication_times.append("점심")
+                with time_cols[2]:
+                    if st.checkbox("🌙 저녁", value=True, key=f"scan_dinner_{bag_idx}"):
+                        medication_times.append("저녁")
+                
+                # 요약 정보 표시
+                end_date = final_date + timedelta(days=medication_duration - 1)
+                st.info(f"""
 📋 **복용 요약**
 - 기간: {final_date.strftime('%Y-%m-%d')} ~ {end_date.strftime('%Y-%m-%d')} ({medication_duration}일)
 - 시간: {', '.join(medication_times) if medication_times else '선택 안 함'}
-- 자동 생성: {medication_duration}개의 복약 기록이 캘린더에 추가됩니다
-            """)
+- 캘린더: {medication_duration}일 동안 매일 복약 일정이 표시됩니다
+                """)
+                
+                schedules.append((bag, final_date, medication_duration, medication_times))
 
-            if st.button("💾 저장하기", type="primary", use_container_width=True):
+            save_label = f"💾 약봉지 {len(bags)}개 모두 저장하기" if len(bags) > 1 else "💾 저장하기"
+            if st.button(save_label, type="primary", use_container_width=True):
                 if st.session_state.patient_name and st.session_state.user_id:
-                    if not medication_times:
+                    if any(not medication_times for _, _, _, medication_times in schedules):
                         st.warning("⚠️ 복용 시간을 최소 1개 선택해주세요!")
                     else:
                         try:
-                            with st.spinner(f"💾 {medication_duration}일치 기록 생성 중..."):
-                                save_datetime = datetime.combine(final_date, datetime.min.time().replace(hour=12))
-                                
-                                # 1일차 원본 기록 저장
-                                parent_id = save_to_database(
-                                    st.session_state.patient_name,
-                                    st.session_state.patient_age,
-                                    medicines,
-                                    extracted_data.get('hospital', ''),
-                                    json.dumps(all_medicine_info, ensure_ascii=False),
-                                    save_datetime.isoformat(),
-                                    st.session_state.user_id,
-                                    medication_duration=medication_duration,
-                                    medication_times=medication_times,
-                                    is_recurring=False,
-                                    parent_record_id=None
-                                )
+                            with st.spinner("💾 복약 일정 저장 중..."):
+                                # 약봉지마다 복용 기간 전체를 일정 기록 1개로 만들어 한 번에 저장
+                                rows = [
+                                    build_record_row(
+                                        st.session_state.patient_name,
+                                        st.session_state.patient_age,
+                                        bag['medicines'],
+                                        bag['extracted_data'].get('hospital', ''),
+                                        json.dumps(bag['all_medicine_info'], ensure_ascii=False),
+                                        datetime.combine(final_date, datetime.min.time().replace(hour=12)).isoformat(),
+                                        st.session_state.user_id,
+                                        medication_duration=medication_duration,
+                                        medication_times=medication_times,
+                                        is_schedule=True,
+                                        save_key=f"{result['save_key']}:{bag_idx}" if result.get('save_key') else None
+                                    )
+                                    for bag_idx, (bag, final_date, medication_duration, medication_times) in enumerate(schedules)
+                                ]
+                                record_ids = save_records_bulk(rows)
                                 
-                                if parent_id:
-                                    # 2일차부터 자동 생성
-                                    if medication_duration > 1:
-                                        created = create_recurring_records(
-                                            st.session_state.patient_name,
-                                            st.session_state.patient_age,
-                                            medicines,
-                                            extracted_data.get('hospital', ''),
-                                            json.dumps(all_medicine_info, ensure_ascii=False),
-                                            save_datetime,
-                                            st.session_state.user_id,
-                                            medication_duration,
-                                            medication_times,
-                                            parent_id
-                                        )
-                                        st.success(f"✅ 총 {medication_duration}일치 기록 생성 완료!")
+                                if record_ids is not None:
+                                    if len(rows) > 1:
+                                        st.success(f"✅ 약봉지 {len(rows)}개 복약 일정 저장 완료!")
+                                    elif rows[0]['medication_duration'] > 1:
+                                        st.success(f"✅ 총 {rows[0]['medication_duration']}일 복약 일정 저장 완료!")
                                     else:
                                         st.success("✅ 저장 완료!")
                                     
@@ -1375,8 +2857,12 @@ elif st.session_state.user_role == "부모님":
                 else:
                     st.warning("⚠️ 사이드바에서 이름을 먼저 입력해주세요!")
 
+    with tab1:
+        scan_panel()
+    
     # ==================== 탭2: 챗봇 ====================
-    with tab2:
+    @st.fragment
+    def chatbot_panel():
         st.markdown("## 💬 의약품 정보 챗봇")
         st.markdown("궁금한 약 이름을 물어보세요. 식약처 공식 데이터로 답변드립니다!")
         
@@ -1416,7 +2902,7 @@ elif st.session_state.user_role == "부모님":
                                 bot_msg = f"'{q}'에 대한 정보를 찾지 못했습니다. 다른 약 이름으로 시도해보세요!"
                             
                             st.session_state.chat_messages.append({"role": "assistant", "content": bot_msg})
-                        st.rerun()
+                        st.rerun(scope="fragment")
         
         st.divider()
         
@@ -1470,94 +2956,65 @@ elif st.session_state.user_role == "부모님":
         if len(st.session_state.chat_messages) > 0:
             if st.button("🗑️ 대화 초기화", key="clear_chat", use_container_width=True):
                 st.session_state.chat_messages = []
-                st.rerun()
+                st.rerun(scope="fragment")
+        
+        # 운영 확인용: secrets에 SHOW_CACHE_STATS = true 설정 시 표시
+        if st.secrets.get("SHOW_CACHE_STATS", False):
+            stats = get_mfds_cache().stats()
+            st.caption(
+                f"📈 식약처 캐시 — 메모리 {stats['memory_hits']} · 디스크 {stats['disk_hits']} · "
+                f"만료 {stats['stale']} · 미적중 {stats['misses']} (적중률 {stats['hit_rate']:.0%})"
+            )
+            parse_stats = get_parse_metrics().stats()
+            st.caption(
+                f"🧩 GPT JSON 파싱 — {parse_stats['total']}회 중 복구 {parse_stats['repaired']} · "
+                f"실패 {parse_stats['failed']} (실패율 {parse_stats['failure_rate']:.1%})"
+            )
 
+    with tab2:
+        chatbot_panel()
+    
     # ==================== 탭3: 복약 캘린더 ====================
-    with tab3:
+    @st.fragment
+    def calendar_panel():
         st.markdown("## 📅 복약 캘린더 & 처방 기록 관리")
         
         if not st.session_state.patient_name:
             st.markdown('<div class="warning-box">⚠️ 로그인 오류가 발생했습니다!</div>', unsafe_allow_html=True)
         else:
-            col1, col2, col3 = st.columns([2, 3, 2])
-            
-            with col1:
-                if 'calendar_year' not in st.session_state:
-                    st.session_state.calendar_year = datetime.now().year
-                if 'calendar_month' not in st.session_state:
-                    st.session_state.calendar_month = datetime.now().month
-                
-                year = st.selectbox(
-                    "연도",
-                    range(2020, 2030),
-                    index=st.session_state.calendar_year - 2020,
-                    key="year_select"
-                )
-                st.session_state.calendar_year = year
-            
-            with col2:
-                month = st.selectbox(
-                    "월",
-                    range(1, 13),
-                    index=st.session_state.calendar_month - 1,
-                    format_func=lambda x: f"{x}월",
-                    key="month_select"
-                )
-                st.session_state.calendar_month = month
-            
-            with col3:
-                if st.button("📅 오늘로 이동", use_container_width=True):
-                    st.session_state.calendar_year = datetime.now().year
-                    st.session_state.calendar_month = datetime.now().month
-                    st.rerun()
-            
-            st.divider()
-            
-            dates_with_records = get_calendar_data(st.session_state.patient_name, year, month)
+            if 'calendar_year' not in st.session_state:
+                st.session_state.calendar_year = datetime.now().year
+            if 'calendar_month' not in st.session_state:
+                st.session_state.calendar_month = datetime.now().month
             
-            st.markdown(f"### 📆 {year}년 {month}월")
-            
-            weekdays = ["월", "화", "수", "목", "금", "토", "일"]
-            cols = st.columns(7)
-            for idx, day in enumerate(weekdays):
-                with cols[idx]:
-                    st.markdown(f"<div style='text-align: center; font-weight: 700; color: white; font-size: 1.1em;'>{day}</div>", unsafe_allow_html=True)
+            # 3개월 구간을 한 번에 받아 둔 날짜별 요약 (같은 구간 안에서는 조회 없음)
+            window_start, window_end, day_index = get_calendar_days(
+                st.session_state.patient_name,
+                st.session_state.calendar_year,
+                st.session_state.calendar_month
+            )
             
-            cal = calendar.monthcalendar(year, month)
-            today = datetime.now().date()
+            calendar_event = medication_calendar(
+                st.session_state.calendar_year,
+                st.session_state.calendar_month,
+                window_start,
+                window_end,
+                day_index,
+                selected=st.session_state.get('selected_date'),
+                key="medication_calendar"
+            )
             
-            for week in cal:
-                cols = st.columns(7)
-                for idx, day in enumerate(week):
-                    with cols[idx]:
-                        if day == 0:
-                            st.markdown("<div style='height: 80px;'></div>", unsafe_allow_html=True)
-                        else:
-                            current_date = datetime(year, month, day).date()
-                            has_record = day in dates_with_records
-                            is_today = current_date == today
-                            
-                            if has_record and is_today:
-                                button_type = "primary"
-                                emoji = "📍"
-                            elif has_record:
-                                button_type = "secondary"
-                                emoji = "💊"
-                            elif is_today:
-                                button_type = "primary"
-                                emoji = "📅"
-                            else:
-                                button_type = "secondary"
-                                emoji = ""
-                            
-                            if st.button(
-                                f"{emoji} {day}",
-                                key=f"day_{year}_{month}_{day}",
-                                use_container_width=True,
-                                type=button_type
-                            ):
-                                st.session_state.selected_date = current_date
-                                st.rerun()
+            # 컴포넌트 값은 다음 실행에도 남아 있으므로 nonce로 새 이벤트만 처리
+            if calendar_event and calendar_event.get('nonce') != st.session_state.get('calendar_nonce'):
+                st.session_state.calendar_nonce = calendar_event['nonce']
+                if calendar_event.get('date'):
+                    selected_date = datetime.strptime(calendar_event['date'], '%Y-%m-%d').date()
+                    st.session_state.selected_date = selected_date
+                    st.session_state.calendar_year = selected_date.year
+                    st.session_state.calendar_month = selected_date.month
+                elif calendar_event.get('month'):
+                    st.session_state.calendar_year, st.session_state.calendar_month = map(int, calendar_event['month'].split('-'))
+                    st.rerun(scope="fragment")
             
             st.divider()
             
@@ -1565,7 +3022,10 @@ elif st.session_state.user_role == "부모님":
                 selected_date = st.session_state.selected_date
                 st.markdown(f"## 📋 {selected_date.strftime('%Y년 %m월 %d일')} 처방 기록")
                 
-                records = get_records_by_date(st.session_state.patient_name, selected_date)
+                selected_summary = get_calendar_month(
+                    st.session_state.patient_name, selected_date.year, selected_date.month
+                ).get(selected_date.isoformat())
+                records = selected_summary['records'] if selected_summary else []
                 
                 if records:
                     st.success(f"✅ {len(records)}건의 처방 기록이 있습니다")
@@ -1591,23 +3051,41 @@ elif st.session_state.user_role == "부모님":
                                     st.markdown("**💊 처방 약물:**")
                                     for med in medicines:
                                         st.markdown(f"- {med}")
+                                
+                                # 약 상세 정보는 펼칠 때만 조회
+                                if st.toggle("📄 약 상세 정보", key=f"analysis_{record['id']}"):
+                                    analysis = get_record_analysis(record['id'])
+                                    if analysis:
+                                        for info in analysis:
+                                            st.markdown(f"**💊 {info.get('약품명', '-')}**")
+                                            st.write(f"효능: {info.get('효능효과', '-')}")
+                                            st.write(f"복용법: {info.get('용법용량', '-')}")
+                                            st.write(f"주의사항: {info.get('주의사항', '-')}")
+                                    else:
+                                        st.caption("저장된 상세 정보가 없습니다")
                             
                             with col2:
-                                taken = record.get('taken', False)
-                                if taken:
-                                    st.success("✅ 복용 완료")
-                                else:
-                                    if st.button("✅ 먹었어요", key=f"take_{record['id']}", use_container_width=True):
+                                # 일정 기록은 복용 시간마다 따로 체크
+                                slots = dose_slots(record) if record.get('is_schedule') else ['']
+                                for slot in slots:
+                                    label = f"{slot} " if slot else ""
+                                    if record.get('taken', False) or slot in record.get('taken_times', []):
+                                        st.success(f"✅ {label}복용 완료")
+                                    elif st.button(f"✅ {label}먹었어요", key=f"take_{record['id']}_{slot}", use_container_width=True):
                                         medicines = record.get('medicines', [])
-                                        if mark_as_taken(record['id'], st.session_state.patient_name, medicines, st.session_state.user_id):
+                                        dose_date = record['occurrence_date'] if record.get('is_schedule') else None
+                                        if mark_as_taken(record['id'], st.session_state.patient_name, medicines, st.session_state.user_id, dose_date=dose_date, dose_time=slot):
                                             st.success("✅ 복용 완료! 자녀에게 알림이 전송되었습니다.")
-                                            st.rerun()
+                                            st.rerun(scope="fragment")
                             
                             with col3:
                                 if st.button("🗑️", key=f"del_{record['id']}", use_container_width=True):
-                                    if delete_record(record['id']):
+                                    # 일정 기록은 이 날짜만 제외
+                                    dose_date = record['occurrence_date'] if record.get('is_schedule') else None
+                                    if delete_record(record['id'], dose_date=dose_date):
                                         st.success("삭제 완료!")
-                                        st.rerun()
+                                        # 기록 자체를 지우면 사이드바 통계도 바뀌므로 전체 새로고침
+                                        st.rerun(scope="fragment" if dose_date else "app")
                             
                             st.markdown('</div>', unsafe_allow_html=True)
                             st.markdown("<br>", unsafe_allow_html=True)
@@ -1644,6 +3122,49 @@ elif st.session_state.user_role == "부모님":
                             else:
                                 st.warning("병원명과 약 이름을 모두 입력해주세요")
 
+    @st.fragment
+    def record_history_panel():
+        """전체 처방 기록 (최신순, 켤 때만 조회하고 더 보기마다 다음 페이지만 가져옴)"""
+        if not st.session_state.patient_name:
+            return
+        if not st.toggle("📜 전체 처방 기록 보기", key="record_history"):
+            st.session_state.record_history_pages = 1
+            return
+
+        pages = st.session_state.setdefault('record_history_pages', 1)
+        history, before, has_more = [], None, False
+        for _ in range(pages):
+            page = get_records_by_user(st.session_state.patient_name, before=before)
+            history.extend(page)
+            has_more = len(page) == RECORD_PAGE_SIZE
+            if not has_more:
+                break
+            before = (page[-1]['scan_date'], page[-1]['id'])
+
+        if not history:
+            st.info("저장된 처방 기록이 없습니다")
+            return
+
+        for record in history:
+            medicines = record.get('medicines') or []
+            period = f" · {record.get('medication_duration')}일" if record.get('is_schedule') else ""
+            st.markdown(
+                f"**{record.get('scan_date', '')[:10]}**{period} · {record.get('hospital') or '정보 없음'} — "
+                f"{', '.join(medicines) if isinstance(medicines, list) else '정보 없음'}"
+            )
+
+        if has_more:
+            # 클릭 시 페이지 수를 먼저 늘리고 이 영역만 다시 그림
+            st.button(
+                "더 보기", key="record_history_more", use_container_width=True,
+                on_click=lambda: st.session_state.update(record_history_pages=pages + 1)
+            )
+
+    with tab3:
+        calendar_panel()
+        st.divider()
+        record_history_panel()
+
 else:  # 자녀 모드
     tab1, tab2, tab3 = st.tabs(["👨‍👩‍👧 부모님 연결", "🔔 알림", "📊 복약 현황"])
     
@@ -1695,7 +3216,8 @@ else:  # 자녀 모드
                     if isinstance(parent_info, dict):
                         st.info(f"👤 {parent_info.get('name')} ({parent_info.get('age')}세)")
     
-    with tab2:
+    @st.fragment
+    def notification_panel():
         st.markdown("## 🔔 복약 알림")
         
         if not st.session_state.user_id:
@@ -1720,12 +3242,12 @@ else:  # 자녀 모드
                     with col2:
                         if st.button("읽음", key=f"read_{notif['id']}", use_container_width=True):
                             mark_notification_as_read(notif['id'])
-                            st.rerun()
+                            st.rerun(scope="fragment")
                 
                 if st.button("모두 읽음 처리", use_container_width=True):
                     mark_all_notifications_as_read(st.session_state.user_id)
                     st.success("모든 알림을 읽음 처리했습니다")
-                    st.rerun()
+                    st.rerun(scope="fragment")
                 
                 st.divider()
             
@@ -1746,6 +3268,18 @@ else:  # 자녀 모드
                     """, unsafe_allow_html=True)
             else:
                 st.info("알림 내역이 없습니다")
+            
+            # 운영 확인용: secrets에 SHOW_CACHE_STATS = true 설정 시 표시
+            if st.secrets.get("SHOW_CACHE_STATS", False):
+                telegram_stats = get_notification_outbox().throttle.stats()
+                st.caption(
+                    f"📨 텔레그램 전송 — {telegram_stats['sent']}건 (알림 {telegram_stats['messages']}개) · "
+                    f"429 {telegram_stats['rate_limited']} · 실패 {telegram_stats['failed']} · "
+                    f"지연 p50 {telegram_stats['p50']:.1f}초 / p90 {telegram_stats['p90']:.1f}초 / p99 {telegram_stats['p99']:.1f}초"
+                )
+    
+    with tab2:
+        notification_panel()
     
     with tab3:
         st.markdown("## 📊 부모님 복약 현황")
@@ -1779,6 +3313,8 @@ else:  # 자녀 모드
                                 
                                 if med.get('taken'):
                                     st.success(f"✅ {med_str} - 복용 완료")
+                                elif med.get('taken_times'):
+                                    st.warning(f"⏰ {med_str} - {', '.join(med['taken_times'])} 복용, 남은 복용 있음")
                                 else:
                                     st.warning(f"⏰ {med_str} - 아직 복용 전")
                             
@@ -1792,9 +3328,8 @@ else:  # 자녀 모드
                     st.divider()
                     
                     # 최근 7일 통계
-                    all_records = get_records_by_user(parent_name)
-                    week_ago = datetime.now().date() - timedelta(days=7)
-                    week_records = [r for r in all_records if datetime.fromisoformat(r.get('scan_date', '')).date() >= week_ago]
+                    today = datetime.now().date()
+                    week_records = get_records_in_range(parent_name, today - timedelta(days=7), today)
                     
                     taken_count = sum(1 for r in week_records if r.get('taken', False))
                     total_count = len(week_records)
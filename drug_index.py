@@ -0,0 +1,380 @@
+"""
+식약처 e약은요 로컬 검색 색인
+
+e약은요 전체 데이터를 SQLite FTS5 색인으로 내려받아 두고, 챗봇 검색을
+원격 API 대신 로컬에서 처리합니다. 약 이름은 한글 자모로 분해한 뒤
+trigram으로 색인하므로 오타나 띄어쓰기가 달라도 비슷한 이름을 찾습니다.
+
+동기화 (식약처 API 키는 환경변수 MFDS_API_KEY 또는 .streamlit/secrets.toml):
+    python drug_index.py sync
+    python drug_index.py search 타이레놀
+"""
+import os
+import sys
+import time
+import json
+import sqlite3
+import threading
+import unicodedata
+import re
+import difflib
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_PATH = os.path.join(BASE_DIR, ".cache", "drug_index.sqlite3")
+MFDS_LIST_URL = "https://apis.data.go.kr/1471000/DrbEasyDrugInfoService/getDrbEasyDrugList"
+SYNC_PAGE_SIZE = 100  # e약은요 API 한 페이지 최대 행 수
+
+# e약은요 XML 필드 → 앱에서 쓰는 한글 키
+MFDS_FIELDS = [
+    ('itemName', '제품명', ''),
+    ('entpName', '업체명', ''),
+    ('itemSeq', '품목기준코드', ''),
+    ('efcyQesitm', '효능효과', '정보 없음'),
+    ('useMethodQesitm', '사용법', '정보 없음'),
+    ('atpnWarnQesitm', '주의사항_경고', '정보 없음'),
+    ('atpnQesitm', '주의사항', '정보 없음'),
+    ('intrcQesitm', '상호작용', '정보 없음'),
+    ('seQesitm', '부작용', '정보 없음'),
+    ('depositMethodQesitm', '보관방법', '정보 없음'),
+    ('itemImage', '낱알이미지', ''),
+    ('openDe', '공개일자', ''),
+    ('updateDe', '수정일자', ''),
+]
+
+# ==================== 한글 자모 ====================
+CHOSEONG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+JUNGSEONG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+JONGSEONG = ["", "ㄱ", "ㄲ", "ㄳ", "ㄴ", "ㄵ", "ㄶ", "ㄷ", "ㄹ", "ㄺ", "ㄻ", "ㄼ", "ㄽ", "ㄾ", "ㄿ", "ㅀ",
+             "ㅁ", "ㅂ", "ㅄ", "ㅅ", "ㅆ", "ㅇ", "ㅈ", "ㅊ", "ㅋ", "ㅌ", "ㅍ", "ㅎ"]
+
+def normalize_name(name):
+    """검색용 이름 정규화 (전각/반각 통일, 공백 제거, 소문자)"""
+    name = unicodedata.normalize('NFKC', name or '')
+    return re.sub(r'\s+', '', name).lower()
+
+def decompose_hangul(text):
+    """한글 음절을 자모로 분해 ('타이레놀' → 'ㅌㅏㅇㅣㄹㅔㄴㅗㄹ'), 나머지 문자는 그대로"""
+    result = []
+    for char in normalize_name(text):
+        code = ord(char) - 0xAC00
+        if 0 <= code < 11172:
+            result.append(CHOSEONG[code // 588])
+            result.append(JUNGSEONG[(code % 588) // 28])
+            result.append(JONGSEONG[code % 28])
+        else:
+            result.append(char)
+    return "".join(result)
+
+def name_similarity(query, name):
+    """자모 기준 전체 이름 유사도 (0~1, OCR 이름 보정용)"""
+    return difflib.SequenceMatcher(None, decompose_hangul(query), decompose_hangul(name)).ratio()
+
+def search_similarity(query, name):
+    """
+    검색 순위용 이름 유사도 (0~1)
+
+    제품명 뒤에 붙는 "정", "500밀리그램" 같은 꼬리 때문에 점수가 깎이지 않도록
+    전체 비교와 검색어 길이만큼의 앞부분 비교 중 높은 값을 씁니다.
+    앞부분만 같아도 1.0이 되므로 이름 보정에는 쓰지 않습니다.
+    """
+    query_jamo = decompose_hangul(query)
+    name_jamo = decompose_hangul(name)
+    full = difflib.SequenceMatcher(None, query_jamo, name_jamo).ratio()
+    prefix = difflib.SequenceMatcher(None, query_jamo, name_jamo[:len(query_jamo)]).ratio()
+    return max(full, prefix)
+
+# ==================== 식약처 응답 파싱 ====================
+def parse_mfds_item(item):
+    """e약은요 <item> 요소를 한글 키 dict로 변환"""
+    info = {}
+    for tag, key, default in MFDS_FIELDS:
+        element = item.find(tag)
+        info[key] = element.text if element is not None and element.text else default
+    return info
+
+def fetch_mfds_page(session, api_key, page_no, page_size=SYNC_PAGE_SIZE):
+    """
+    e약은요 목록 한 페이지 조회
+
+    Returns:
+        (약 정보 리스트, 전체 건수)
+    """
+    params = urllib.parse.urlencode({'pageNo': str(page_no), 'numOfRows': str(page_size), 'type': 'xml'})
+    response = session.get(f"{MFDS_LIST_URL}?serviceKey={api_key}&{params}", timeout=30)
+    response.raise_for_status()
+
+    root = ET.fromstring(response.content)
+    result_code = root.find('.//resultCode')
+    if result_code is None or result_code.text != '00':
+        result_msg = root.find('.//resultMsg')
+        raise RuntimeError(f"식약처 API 오류: {result_msg.text if result_msg is not None else '알 수 없는 오류'}")
+
+    total_count = root.find('.//totalCount')
+    total = int(total_count.text) if total_count is not None and total_count.text else 0
+    return [parse_mfds_item(item) for item in root.findall('.//item')], total
+
+# ==================== 색인 생성 ====================
+SCHEMA = """
+CREATE TABLE drugs (
+    item_seq TEXT PRIMARY KEY,
+    item_name TEXT NOT NULL,
+    entp_name TEXT,
+    info TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE drugs_fts USING fts5(
+    item_seq UNINDEXED,
+    name_jamo,
+    tokenize = 'trigram'
+);
+CREATE TABLE sync_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def insert_items(conn, items):
+    """약 정보 리스트를 색인에 추가 (같은 품목기준코드는 교체)"""
+    for info in items:
+        item_seq = info['품목기준코드'] or info['제품명']
+        conn.execute("DELETE FROM drugs_fts WHERE item_seq = ?", (item_seq,))
+        conn.execute(
+            "INSERT OR REPLACE INTO drugs (item_seq, item_name, entp_name, info) VALUES (?, ?, ?, ?)",
+            (item_seq, info['제품명'], info['업체명'], json.dumps(info, ensure_ascii=False))
+        )
+        conn.execute(
+            "INSERT INTO drugs_fts (item_seq, name_jamo) VALUES (?, ?)",
+            (item_seq, decompose_hangul(info['제품명']))
+        )
+
+def build_index(api_key, path=DEFAULT_INDEX_PATH, page_size=SYNC_PAGE_SIZE, progress=print):
+    """
+    e약은요 전체를 페이지 단위로 내려받아 색인 파일 생성
+
+    임시 파일에 만든 뒤 교체하므로, 동기화 중에도 앱은 이전 색인으로 계속 검색합니다.
+
+    Returns:
+        색인된 약 수
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(['GET']))
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        page_no, total, indexed = 1, None, 0
+        while total is None or (page_no - 1) * page_size < total:
+            items, total = fetch_mfds_page(session, api_key, page_no, page_size)
+            if not items:
+                break
+            with conn:
+                insert_items(conn, items)
+            indexed += len(items)
+            if progress:
+                progress(f"{indexed}/{total} 색인 완료")
+            page_no += 1
+
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('synced_at', ?)", (str(time.time()),))
+            conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES ('item_count', ?)", (str(indexed),))
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, path)
+    return indexed
+
+# ==================== 검색 ====================
+class DrugIndex:
+    """로컬 e약은요 색인 검색 (스레드 안전, 색인 파일이 바뀌면 다시 연결)"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, min_score=0.6):
+        self.path = path
+        self.min_score = min_score
+        self._conn = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        """최신 색인 파일 연결 반환. 색인이 없으면 None"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        if self._conn is None or mtime != self._mtime:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._mtime = mtime
+        return self._conn
+
+    @property
+    def version(self):
+        """색인 파일 수정 시각 (없으면 None) — 색인 갱신 감지용"""
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    @property
+    def available(self):
+        with self._lock:
+            return self._connection() is not None
+
+    def names(self):
+        """색인된 전체 제품명 리스트"""
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return []
+            return [row[0] for row in conn.execute("SELECT item_name FROM drugs")]
+
+    def search(self, query, limit=10):
+        """
+        이름으로 약 검색 (오타 허용)
+
+        Returns:
+            [(약 정보 dict, 유사도)] — 유사도 높은 순, min_score 미만은 제외
+        """
+        query_jamo = decompose_hangul(query)
+        if not query_jamo:
+            return []
+
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return []
+
+            if len(query_jamo) < 3:
+                # trigram을 만들 수 없는 짧은 검색어는 앞부분 일치로
+                rows = conn.execute(
+                    "SELECT info FROM drugs WHERE item_name LIKE ? LIMIT 50",
+                    (query.strip() + '%',)
+                ).fetchall()
+            else:
+                # 검색어 trigram 중 하나라도 겹치는 후보를 bm25 순으로 가져온 뒤 유사도로 재정렬
+                trigrams = {query_jamo[i:i + 3] for i in range(len(query_jamo) - 2)}
+                match = " OR ".join('"' + gram.replace('"', '""') + '"' for gram in trigrams)
+                rows = conn.execute(
+                    """
+                    SELECT d.info FROM drugs_fts f JOIN drugs d ON d.item_seq = f.item_seq
+                    WHERE drugs_fts MATCH ? ORDER BY bm25(drugs_fts) LIMIT 50
+                    """,
+                    (match,)
+                ).fetchall()
+
+        scored = []
+        for (info_json,) in rows:
+            info = json.loads(info_json)
+            score = search_similarity(query, info['제품명'])
+            if score >= self.min_score:
+                scored.append((info, score))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        return scored[:limit]
+
+# ==================== OCR 이름 보정 ====================
+def jamo_trigrams(text):
+    """자모 trigram 집합 (짧은 이름은 통째로 하나)"""
+    jamo = decompose_hangul(text)
+    if len(jamo) < 3:
+        return {jamo} if jamo else set()
+    return {jamo[i:i + 3] for i in range(len(jamo) - 2)}
+
+class DrugNameMatcher:
+    """
+    OCR로 읽은 약 이름을 사전의 정식 제품명으로 보정하는 메모리 trigram 색인
+
+    trigram마다 그 trigram을 가진 이름 번호 목록만 들고 있어 수천 개 이름도
+    수 MB 안에서 밀리초 단위로 후보를 찾습니다.
+    """
+
+    def __init__(self, names, min_confidence=0.85, max_candidates=30):
+        self.names = sorted({name for name in names if name})
+        self.min_confidence = min_confidence
+        self.max_candidates = max_candidates
+        self._exact = {normalize_name(name): name for name in self.names}
+        self._postings = {}
+        for name_id, name in enumerate(self.names):
+            for gram in jamo_trigrams(name):
+                self._postings.setdefault(gram, []).append(name_id)
+
+    def candidates(self, text):
+        """[(제품명, 유사도)] 유사도 높은 순"""
+        counts = {}
+        for gram in jamo_trigrams(text):
+            for name_id in self._postings.get(gram, ()):
+                counts[name_id] = counts.get(name_id, 0) + 1
+        # 겹치는 trigram이 많은 이름만 정밀 비교
+        top_ids = sorted(counts, key=counts.get, reverse=True)[:self.max_candidates]
+        scored = [(self.names[name_id], name_similarity(text, self.names[name_id])) for name_id in top_ids]
+        # 같은 점수면 전체 길이까지 비슷한 이름 우선
+        scored.sort(key=lambda pair: (pair[1], -abs(len(pair[0]) - len(text))), reverse=True)
+        return scored
+
+    def resolve(self, text):
+        """
+        OCR 이름 1개 보정
+
+        Returns:
+            {'ocr': 원래 이름, 'name': 보정된 이름, 'confidence': 0~1 또는 None, 'corrected': 보정 여부}
+            확신이 부족하거나 후보가 비슷하게 여럿이면 원래 이름을 유지합니다.
+            OCR 이름이 후보의 앞부분과 같기만 한 경우("아스피린" → "아스피린프로텍트정...")는
+            약봉지에 없는 제품/용량을 붙이게 되므로 보정하지 않습니다.
+        """
+        exact = self._exact.get(normalize_name(text))
+        if exact:
+            return {'ocr': text, 'name': exact, 'confidence': 1.0, 'corrected': exact != text}
+
+        candidates = self.candidates(text)
+        if not candidates:
+            return {'ocr': text, 'name': text, 'confidence': None, 'corrected': False}
+
+        best_name, best_score = candidates[0]
+        ambiguous = len(candidates) > 1 and best_score - candidates[1][1] < 0.02
+        strict_prefix = normalize_name(best_name).startswith(normalize_name(text))
+        if best_score >= self.min_confidence and not ambiguous and not strict_prefix:
+            return {'ocr': text, 'name': best_name, 'confidence': best_score, 'corrected': True}
+        return {'ocr': text, 'name': text, 'confidence': best_score, 'corrected': False}
+
+# ==================== CLI ====================
+def load_secret(name):
+    """환경변수 → .streamlit/secrets.toml 순으로 설정값 조회"""
+    if os.environ.get(name):
+        return os.environ[name]
+    secrets_path = os.path.join(BASE_DIR, ".streamlit", "secrets.toml")
+    if os.path.exists(secrets_path):
+        import tomllib
+        with open(secrets_path, "rb") as f:
+            return tomllib.load(f).get(name)
+    return None
+
+def main(argv):
+    if len(argv) >= 2 and argv[1] == "sync":
+        api_key = load_secret("MFDS_API_KEY")
+        if not api_key:
+            print("MFDS_API_KEY가 없습니다 (환경변수 또는 .streamlit/secrets.toml)")
+            return 1
+        path = argv[2] if len(argv) >= 3 else DEFAULT_INDEX_PATH
+        started = time.time()
+        count = build_index(api_key, path)
+        print(f"✅ {count}개 약 색인 완료 ({time.time() - started:.0f}초): {path}")
+        return 0
+    if len(argv) >= 3 and argv[1] == "search":
+        for info, score in DrugIndex().search(" ".join(argv[2:])):
+            print(f"{score:.2f}  {info['제품명']} ({info['업체명']})")
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
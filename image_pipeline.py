@@ -0,0 +1,313 @@
+"""
+약봉지 사진 Vision 업로드 준비
+
+휴대폰 원본 사진(4000×3000 등)을 그대로 PNG로 보내면 수 MB가 되고 Vision
+타일 수만큼 토큰이 청구됩니다. 여기서는 글자가 있는 영역만 잘라내고,
+Vision이 실제로 보는 해상도까지만 줄인 뒤, 용량 예산에 맞춰 WebP/JPEG
+품질을 골라 인코딩합니다.
+
+Vision 고해상도(detail=high) 과금 규칙:
+    1. 2048×2048 안에 들어오도록 축소
+    2. 짧은 변이 768을 넘으면 768로 축소
+    3. 512×512 타일 하나당 170토큰 + 기본 85토큰
+
+OCR 보정(선명도·대비)은 NumPy로 한 번에 계산합니다. 이전 방식과 속도 비교:
+    python image_pipeline.py bench
+"""
+import base64
+import io
+import math
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+VISION_MAX_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+VISION_TILE_SIZE = 512
+VISION_TILE_TOKENS = 170
+VISION_BASE_TOKENS = 85
+VISION_LOW_DETAIL_SIDE = 512
+
+UPSCALE_MIN_WIDTH = 1000  # 작은 사진은 글자가 뭉개지지 않게 이 너비까지 확대
+VISION_MAX_TILES = 6  # 이보다 타일이 많으면 해상도를 더 낮춤
+VISION_MAX_BYTES = 400 * 1024  # 인코딩 결과 용량 예산
+VISION_QUALITIES = (85, 75, 65, 55, 45)
+VISION_FORMATS = ('WEBP', 'JPEG')
+
+SHARPNESS = 2.0  # ImageEnhance.Sharpness(2.0)과 같은 강도
+CONTRAST = 1.5  # ImageEnhance.Contrast(1.5)와 같은 강도
+SHARP_LAPLACIAN_VAR = 250.0  # 라플라시안 분산이 이보다 크면 이미 선명한 사진으로 보고 선명화 생략
+
+CROP_EDGE_THRESHOLD = 40  # 이 밝기 차이 이상을 글자/윤곽으로 봄
+CROP_MARGIN = 0.03  # 잘라낸 영역 둘레에 남길 여백 (변 길이 비율)
+CROP_MIN_SAVING = 0.15  # 면적이 이만큼 이상 줄어들 때만 자름
+
+# ==================== 해상도 / 토큰 ====================
+def vision_scaled_size(width, height, detail='high'):
+    """Vision API가 내부적으로 줄여서 보는 크기"""
+    if detail == 'low':
+        scale = min(1.0, VISION_LOW_DETAIL_SIDE / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, VISION_MAX_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def vision_tokens(width, height, detail='high'):
+    """이미지 한 장의 Vision 입력 토큰 수"""
+    if detail == 'low':
+        return VISION_BASE_TOKENS
+    width, height = vision_scaled_size(width, height, detail)
+    tiles = math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE)
+    return VISION_BASE_TOKENS + VISION_TILE_TOKENS * tiles
+
+def vision_target_size(width, height, detail='high', max_tiles=VISION_MAX_TILES):
+    """
+    업로드할 크기 결정
+
+    Vision이 어차피 줄여서 보는 크기보다 크게 보낼 필요가 없으므로 그 크기에
+    맞추고, 타일 예산을 넘으면 예산 안에 들어올 때까지 10%씩 더 줄입니다.
+    작은 사진은 기존처럼 UPSCALE_MIN_WIDTH까지 확대합니다.
+    """
+    if width < UPSCALE_MIN_WIDTH:
+        ratio = UPSCALE_MIN_WIDTH / width
+        width, height = UPSCALE_MIN_WIDTH, round(height * ratio)
+
+    width, height = vision_scaled_size(width, height, detail)
+    while detail != 'low' and math.ceil(width / VISION_TILE_SIZE) * math.ceil(height / VISION_TILE_SIZE) > max_tiles:
+        width, height = max(1, round(width * 0.9)), max(1, round(height * 0.9))
+    return width, height
+
+# ==================== 자르기 / 축소 ====================
+def content_bbox(image, threshold=CROP_EDGE_THRESHOLD, margin=CROP_MARGIN):
+    """
+    글자와 윤곽이 있는 영역의 bbox (없으면 None)
+
+    작게 줄인 흑백 이미지에서 윤곽을 찾아 계산하므로 큰 사진도 빠릅니다.
+    """
+    probe = image.convert('L')
+    probe.thumbnail((512, 512))
+    edges = probe.filter(ImageFilter.FIND_EDGES).point(lambda value: 255 if value >= threshold else 0)
+    # 사진 테두리는 FIND_EDGES가 항상 윤곽으로 잡으므로 제외
+    edges = edges.crop((1, 1, edges.width - 1, edges.height - 1))
+    bbox = edges.getbbox()
+    if not bbox:
+        return None
+
+    scale_x = image.width / probe.width
+    scale_y = image.height / probe.height
+    pad_x = image.width * margin
+    pad_y = image.height * margin
+    left, top, right, bottom = bbox
+    return (
+        max(0, int((left + 1) * scale_x - pad_x)),
+        max(0, int((top + 1) * scale_y - pad_y)),
+        min(image.width, math.ceil((right + 1) * scale_x + pad_x)),
+        min(image.height, math.ceil((bottom + 1) * scale_y + pad_y)),
+    )
+
+def crop_to_content(image, min_saving=CROP_MIN_SAVING):
+    """글자 영역 밖의 빈 배경을 잘라냄 (줄어드는 면적이 작으면 원본 유지)"""
+    bbox = content_bbox(image)
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) > image.width * image.height * (1 - min_saving):
+        return image
+    return image.crop(bbox)
+
+def fit_for_vision(image, detail='high', max_tiles=VISION_MAX_TILES):
+    """Vision 업로드용으로 자르고 크기 조정 (흑백이 아니면 RGB로 변환)"""
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image = crop_to_content(image)
+    target = vision_target_size(image.width, image.height, detail, max_tiles)
+    if target != image.size:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    return image
+
+# ==================== OCR 보정 ====================
+def laplacian_variance(gray):
+    """흑백 배열의 라플라시안 분산 (클수록 선명)"""
+    center = gray[1:-1, 1:-1]
+    laplacian = 4 * center - gray[:-2, 1:-1] - gray[2:, 1:-1] - gray[1:-1, :-2] - gray[1:-1, 2:]
+    return float(laplacian.var())
+
+def smooth(pixels):
+    """PIL ImageFilter.SMOOTH와 같은 3×3 커널 (가운데 5, 주변 1, 합 13)"""
+    pad_width = ((1, 1), (1, 1)) + ((0, 0),) * (pixels.ndim - 2)
+    padded = np.pad(pixels, pad_width, mode='edge')
+    height, width = pixels.shape[:2]
+    total = 4 * pixels
+    for dy in range(3):
+        for dx in range(3):
+            total += padded[dy:dy + height, dx:dx + width]
+    total /= 13
+    return total
+
+def enhance_for_ocr(image, grayscale=False, sharpness=SHARPNESS, contrast=CONTRAST):
+    """
+    선명도와 대비 보정을 한 번에 적용
+
+    ImageEnhance의 Sharpness → Contrast 두 번의 전체 이미지 처리를 식 하나로 합쳤습니다.
+        선명화: x + (s - 1)(x - smooth(x))
+        대비:   mean + c(y - mean)
+    이미 선명한 사진(라플라시안 분산이 큼)은 선명화를 건너뜁니다.
+    Vision 분석에 알약·포장 색이 쓰이므로 기본은 컬러이고, grayscale=True면 흑백으로
+    처리해 계산량을 1/3로 줄입니다.
+    """
+    gray = np.asarray(image.convert('L'), dtype=np.float32)
+    if grayscale:
+        pixels = gray
+    else:
+        pixels = np.asarray(image.convert('RGB'), dtype=np.float32)
+    mean = float(gray.mean())
+
+    if min(gray.shape) >= 3 and laplacian_variance(gray) < SHARP_LAPLACIAN_VAR:
+        # c * (s * x - (s - 1) * smooth(x)) + (1 - c) * mean
+        result = smooth(pixels)
+        result *= -(sharpness - 1) * contrast
+        result += (sharpness * contrast) * pixels
+    else:
+        result = pixels * contrast
+    result += (1 - contrast) * mean
+
+    np.clip(result, 0, 255, out=result)
+    return Image.fromarray(result.astype(np.uint8), 'L' if grayscale else 'RGB')
+
+def preprocess_for_ocr(image, detail='high', grayscale=False):
+    """Vision 업로드 전처리 전체: 자르기·축소 후 보정 (grayscale=True면 먼저 흑백으로 바꿔 계산량을 줄임)"""
+    if grayscale:
+        image = image.convert('L')
+    return enhance_for_ocr(fit_for_vision(image, detail), grayscale=grayscale)
+
+# ==================== 인코딩 ====================
+def encode_image(image, image_format, quality):
+    """이미지를 지정 형식/품질로 인코딩한 바이트"""
+    buffered = io.BytesIO()
+    if image_format == 'WEBP':
+        image.save(buffered, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffered, format='JPEG', quality=quality, optimize=True)
+    return buffered.getvalue()
+
+def encode_for_vision(image, max_bytes=VISION_MAX_BYTES, qualities=VISION_QUALITIES, formats=VISION_FORMATS):
+    """
+    용량 예산 안에서 가장 높은 품질로 인코딩
+
+    같은 품질에서는 형식 중 더 작은 쪽을 고르고, 예산을 넘으면 품질을 낮춥니다.
+    가장 낮은 품질로도 넘으면 그중 가장 작은 결과를 씁니다.
+
+    Returns:
+        {'data_url', 'format', 'quality', 'bytes', 'width', 'height'}
+    """
+    smallest = None
+    for quality in qualities:
+        candidates = [(encode_image(image, image_format, quality), image_format) for image_format in formats]
+        data, image_format = min(candidates, key=lambda candidate: len(candidate[0]))
+        if smallest is None or len(data) < len(smallest[0]):
+            smallest = (data, image_format, quality)
+        if len(data) <= max_bytes:
+            break
+
+    data, image_format, quality = smallest
+    mime = 'image/webp' if image_format == 'WEBP' else 'image/jpeg'
+    return {
+        'data_url': f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}",
+        'format': image_format,
+        'quality': quality,
+        'bytes': len(data),
+        'width': image.width,
+        'height': image.height,
+    }
+
+def upload_savings(original_size, original_bytes, encoded, detail='high'):
+    """
+    이전 방식 대비 절약량
+
+    토큰은 원본 사진을 그대로(작으면 확대해서) 보내던 방식 기준이고, 바이트는
+    업로드된 원본 파일 크기 기준입니다. 이전에는 원본보다 큰 PNG를 보냈으므로
+    실제 절약량은 이보다 큽니다.
+
+    Args:
+        original_size: 업로드된 원본 사진 (너비, 높이)
+        original_bytes: 업로드된 원본 파일 크기
+        encoded: encode_for_vision 결과
+    """
+    width, height = original_size
+    if width < UPSCALE_MIN_WIDTH:
+        width, height = UPSCALE_MIN_WIDTH, round(height * UPSCALE_MIN_WIDTH / width)
+    original_tokens = vision_tokens(width, height, detail)
+    tokens = vision_tokens(encoded['width'], encoded['height'], detail)
+    return {
+        'original_bytes': original_bytes,
+        'bytes': encoded['bytes'],
+        'bytes_saved': max(0, original_bytes - encoded['bytes']),
+        'original_tokens': original_tokens,
+        'tokens': tokens,
+        'tokens_saved': max(0, original_tokens - tokens),
+    }
+
+# ==================== 벤치마크 ====================
+BENCH_SIZES = [(1000, 750), (2000, 1500), (3024, 4032), (4000, 3000)]
+
+def sample_photo(width, height):
+    """약봉지와 비슷한 테스트 사진 (배경 잡음 + 글자 + 약한 흐림)"""
+    rng = np.random.default_rng(0)
+    noise = rng.normal(225, 12, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(noise, 'RGB')
+    draw = ImageDraw.Draw(image)
+    left, top = width // 4, height // 4
+    draw.rectangle((left, top, width - left, height - top), fill=(250, 250, 245), outline=(30, 30, 30), width=4)
+    for row in range(top + 20, height - top - 20, max(12, height // 60)):
+        draw.text((left + 20, row), "Tylenol 500mg 1T tid pc  x3days", fill=(20, 20, 20))
+    return image.filter(ImageFilter.GaussianBlur(1.2))
+
+def legacy_preprocess(image):
+    """이전 전처리 (원본 크기 그대로 ImageEnhance 두 번)"""
+    if image.width < UPSCALE_MIN_WIDTH:
+        ratio = UPSCALE_MIN_WIDTH / image.width
+        image = image.resize((UPSCALE_MIN_WIDTH, int(image.height * ratio)), Image.Resampling.LANCZOS)
+    image = ImageEnhance.Sharpness(image).enhance(SHARPNESS)
+    return ImageEnhance.Contrast(image).enhance(CONTRAST)
+
+def pil_enhance(image):
+    """ImageEnhance 두 번 (같은 크기에서 보정 단계만 비교)"""
+    image = ImageEnhance.Sharpness(image).enhance(SHARPNESS)
+    return ImageEnhance.Contrast(image).enhance(CONTRAST)
+
+def best_time_ms(function, image, repeat):
+    """repeat회 실행 중 가장 빠른 시간 (ms)"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(image)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def bench(repeat=5):
+    """사진 크기별 전처리 시간 비교"""
+    print("사진 크기   | 이전 전체 | 새 전체 | PIL 보정 | NumPy 보정")
+    for width, height in BENCH_SIZES:
+        image = sample_photo(width, height)
+        fitted = fit_for_vision(image)
+        print(
+            f"{width}×{height:<5} | "
+            f"{best_time_ms(legacy_preprocess, image, repeat):7.1f}ms | "
+            f"{best_time_ms(preprocess_for_ocr, image, repeat):5.1f}ms | "
+            f"{best_time_ms(pil_enhance, fitted, repeat):6.1f}ms | "
+            f"{best_time_ms(enhance_for_ocr, fitted, repeat):8.1f}ms"
+        )
+
+def main(argv):
+    if len(argv) >= 2 and argv[1] == "bench":
+        bench(int(argv[2]) if len(argv) >= 3 else 5)
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
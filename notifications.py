@@ -0,0 +1,610 @@
+"""
+알림 전달 (DB 알림 + 텔레그램) 과 알림 아웃박스 워커
+
+Streamlit에 의존하지 않아서 앱 서버(app.py)와 복약 알림 스케줄러(scheduler.py)가
+같이 씁니다. 이벤트는 notification_outbox 테이블에 먼저 저장되고, 어느 프로세스의
+워커든 선점한 쪽이 자녀 조회 → 알림 저장 → 텔레그램 전송까지 처리합니다.
+텔레그램 메시지도 채팅방별 telegram_message 이벤트라서 전송 성공까지 재시도됩니다.
+"""
+import time
+import heapq
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+OUTBOX_POLL_INTERVAL = 10  # 초, 같은 프로세스에서 넣은 이벤트는 즉시 깨워서 처리
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_LEASE_SECONDS = 300  # 처리 중 프로세스가 죽으면 이 시간 뒤 다른 워커가 다시 가져감
+
+TELEGRAM_GLOBAL_RATE = 25  # 초당 메시지 수 (봇 전체 한도 약 30/초보다 여유 있게)
+TELEGRAM_WORKER_PROCESSES = 2  # 아웃박스 워커를 돌리는 프로세스 수 (앱 서버 + 스케줄러), 전체 한도를 나눠 씀
+TELEGRAM_CHAT_RATE = 1  # 같은 채팅방에는 초당 1개
+TELEGRAM_COALESCE_WINDOW = 3  # 초, 같은 채팅방 알림을 이만큼 모아 한 메시지로 전송
+TELEGRAM_MAX_LENGTH = 3500  # 합친 본문 최대 길이 (sendMessage 한도 4096자, 머리말/꼬리말 여유)
+TELEGRAM_LATENCY_SAMPLES = 1000
+
+NOTIFICATION_SETTINGS_TTL = 300  # 초, 다른 서버에서 바뀐 설정도 이 시간 안에는 반영
+
+def build_telegram_session():
+    """
+    텔레그램 API용 세션
+
+    sendMessage는 POST라서 응답을 못 받은 경우(읽기 타임아웃, 5xx)에 재시도하면
+    메시지가 두 번 갈 수 있습니다. 전송 전 실패(연결 오류)만 재시도하고,
+    429는 아웃박스가 retry_after만큼 기다렸다가 다시 보냅니다.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        status=0,
+        backoff_factor=0.5,
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def retry_after_seconds(response):
+    """429 응답의 재시도 대기 시간 (본문 parameters.retry_after → Retry-After 헤더 순)"""
+    try:
+        retry_after = response.json().get('parameters', {}).get('retry_after')
+    except ValueError:
+        retry_after = None
+    if retry_after is None:
+        retry_after = response.headers.get('Retry-After', 1)
+    try:
+        return max(1.0, float(retry_after))
+    except (TypeError, ValueError):
+        return 1.0
+
+def percentile(sorted_values, fraction):
+    """정렬된 리스트의 백분위 값 (비어 있으면 0)"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def format_medicine_list(medicines):
+    """알림용 약 이름 요약 (최대 3개 + 외 N개)"""
+    medicine_list = ", ".join(medicines[:3])
+    if len(medicines) > 3:
+        medicine_list += f" 외 {len(medicines)-3}개"
+    return medicine_list
+
+# ==================== 텔레그램 전송 속도 조절 ====================
+class TokenBucket:
+    """토큰 버킷 (초당 rate개 충전, 최대 capacity개). 잠금은 쓰는 쪽에서"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def wait_time(self, now):
+        """토큰 1개를 쓰려면 기다려야 하는 시간 (0이면 바로 가능)"""
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = max(now, self._updated)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._tokens -= 1
+
+    def is_full(self, now):
+        return self.wait_time(now) == 0.0 and self._tokens >= self.capacity
+
+class TelegramThrottle:
+    """
+    텔레그램 전송 속도 조절 + 전송 통계 (프로세스당 1개)
+
+    채팅방별/전체 토큰 버킷으로 보낼 수 있는지 판단만 하고, 실제 전송과 재시도는
+    아웃박스 워커가 telegram_message 이벤트로 처리합니다. 전체 버킷은 이 프로세스
+    몫(global_rate)만 쓰므로 여러 프로세스를 합쳐도 봇 전체 한도를 넘지 않습니다.
+    """
+
+    COUNTS = ('sent', 'messages', 'rate_limited', 'failed')
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE):
+        self._lock = threading.Lock()
+        self._global_bucket = TokenBucket(global_rate, max(1, global_rate))
+        self._chat_buckets = {}
+        self._latencies = deque(maxlen=TELEGRAM_LATENCY_SAMPLES)
+        self._counts = dict.fromkeys(self.COUNTS, 0)
+        self._wake_at = []  # 예약된 깨우기 시각 (최소 힙)
+
+    def acquire(self, chat_id):
+        """
+        chat_id로 한 메시지 보낼 토큰 받기
+
+        Returns:
+            (채팅방 대기 시간, 전체 대기 시간). 둘 다 0일 때만 토큰을 씀
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                # 한동안 안 쓴 채팅방 버킷 정리
+                if len(self._chat_buckets) > 1000:
+                    for idle_chat_id in [key for key, value in self._chat_buckets.items() if value.is_full(now)]:
+                        del self._chat_buckets[idle_chat_id]
+                bucket = self._chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, 1)
+            chat_wait = bucket.wait_time(now)
+            global_wait = self._global_bucket.wait_time(now)
+            if chat_wait == 0 and global_wait == 0:
+                bucket.take()
+                self._global_bucket.take()
+            return chat_wait, global_wait
+
+    def record(self, outcome, messages=0, latencies=()):
+        with self._lock:
+            self._counts[outcome] += 1
+            self._counts['messages'] += messages
+            self._latencies.extend(latencies)
+
+    def wake_at(self, seconds):
+        """seconds 뒤 아웃박스 워커가 깨어나도록 예약 (묶음 시간이 지난 메시지 전송용)"""
+        with self._lock:
+            heapq.heappush(self._wake_at, time.monotonic() + seconds)
+
+    def next_wait(self, default):
+        """워커가 다음에 기다릴 시간 (지난 예약은 버리고, 남은 가장 빠른 예약이 더 빠르면 그 시간)"""
+        now = time.monotonic()
+        with self._lock:
+            while self._wake_at and self._wake_at[0] <= now:
+                heapq.heappop(self._wake_at)
+            if not self._wake_at:
+                return default
+            return min(self._wake_at[0] - now, default)
+
+    def stats(self):
+        """전송 통계 (지연 시간은 알림 생성부터 텔레그램 전송 완료까지, 초)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counts = dict(self._counts)
+        return {
+            **counts,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99)
+        }
+
+# ==================== 알림 아웃박스 ====================
+class NotificationOutbox:
+    """
+    알림 이벤트 저장/전달 (프로세스당 1개, start()로 워커 스레드 시작)
+
+    여러 프로세스의 워커가 같은 테이블을 처리해도 선점(status/attempts 비교 갱신)
+    덕분에 한 이벤트는 한 워커만 처리합니다.
+    """
+
+    def __init__(self, supabase, bot_token=None, telegram_enabled=False, worker_processes=TELEGRAM_WORKER_PROCESSES):
+        """
+        Args:
+            worker_processes: 아웃박스 워커를 같이 돌리는 프로세스 수 (텔레그램 전체 한도를 똑같이 나눔)
+        """
+        self.supabase = supabase
+        self.bot_token = bot_token
+        self.telegram_enabled = bool(telegram_enabled and bot_token)
+        self.throttle = TelegramThrottle(TELEGRAM_GLOBAL_RATE / max(1, int(worker_processes)))
+        self._session = build_telegram_session()
+        self._wake_event = threading.Event()
+        self._settings_lock = threading.Lock()
+        self._settings = {}  # user_id → (만료 시각, 텔레그램 설정 또는 None)
+        self.handlers = {
+            'medication_taken': self.handle_medication_taken_event,
+            # medication_reminder / missed_dose는 scheduler.py가 복용 시간에 맞춰 넣음
+            'medication_reminder': self.handle_dose_schedule_event,
+            'missed_dose': self.handle_dose_schedule_event,
+        }
+
+    # ---------- 텔레그램 ----------
+    def post_telegram_message(self, chat_id, message):
+        """텔레그램 sendMessage 호출 (응답 반환, 네트워크 오류는 예외 발생)"""
+        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
+
+        # HTML 포맷으로 예쁘게 만들기
+        formatted_message = f"""<b>💊 복약 알림</b>
+
+{message}
+
+<i>우리 가족 스마트 복약 관리</i>"""
+
+        data = {
+            "chat_id": chat_id,
+            "text": formatted_message,
+            "parse_mode": "HTML"
+        }
+
+        return self._session.post(url, json=data, timeout=10)
+
+    def get_settings(self, user_ids):
+        """
+        사용자별 텔레그램 설정 조회 (캐시에 없는 사용자만 in_ 한 번으로, 실패 시 예외 발생)
+
+        Returns:
+            {user_id: {'telegram_chat_id', 'telegram_enabled'} 또는 None}
+        """
+        now = time.time()
+        settings_by_user, missing = {}, []
+        with self._settings_lock:
+            for user_id in dict.fromkeys(user_ids):
+                item = self._settings.get(user_id)
+                if item and item[0] > now:
+                    settings_by_user[user_id] = item[1]
+                else:
+                    missing.append(user_id)
+
+        if missing:
+            response = self.supabase.table('user_notification_settings')\
+                .select('user_id, telegram_chat_id, telegram_enabled')\
+                .in_('user_id', missing)\
+                .execute()
+            found = {row['user_id']: row for row in response.data or []}
+            with self._settings_lock:
+                if len(self._settings) > 10000:
+                    self._settings = {key: item for key, item in self._settings.items() if item[0] > now}
+                for user_id in missing:
+                    settings_by_user[user_id] = found.get(user_id)
+                    self._settings[user_id] = (now + NOTIFICATION_SETTINGS_TTL, settings_by_user[user_id])
+        return settings_by_user
+
+    def invalidate_settings(self, user_id):
+        """설정 저장 후 호출 (이 프로세스의 캐시에서 바로 제거)"""
+        with self._settings_lock:
+            self._settings.pop(user_id, None)
+
+    # ---------- 알림 ----------
+    def fetch_child_ids(self, parent_user_id):
+        """부모의 자녀 user_id 목록 (실패 시 예외 발생)"""
+        response = self.supabase.table('family_connections')\
+            .select('child_id, users!family_connections_child_id_fkey(id, name)')\
+            .eq('parent_id', parent_user_id)\
+            .execute()
+
+        child_ids = []
+        for child_data in response.data or []:
+            child_info = child_data.get('users', {})
+            if isinstance(child_info, dict):
+                child_id = child_info.get('id')
+            else:
+                child_id = child_data.get('child_id')
+
+            if child_id:
+                child_ids.append(child_id)
+        return child_ids
+
+    def notify_users(self, recipient_user_ids, message, notification_type="medication", event_key=None):
+        """
+        여러 명에게 알림 전송 (DB 일괄 저장 + 텔레그램 전송 이벤트, 실패 시 예외 발생)
+
+        실패하면 예외를 올려 호출한 쪽(아웃박스 워커)이 재시도하게 합니다. 텔레그램은
+        채팅방별 telegram_message 이벤트로 아웃박스에 넣어, 전송 성공까지 재시도합니다.
+
+        Args:
+            event_key: 알림을 만든 아웃박스 이벤트 키. 있으면 DB 알림과 텔레그램 이벤트를
+                이 키로 중복 없이 저장하므로, 중간에 실패해 이벤트 전체를 재시도해도
+                이미 저장된 알림이 두 번 생기지 않습니다.
+        """
+        if not recipient_user_ids:
+            return
+
+        chat_ids = []
+        if self.telegram_enabled:
+            for settings in self.get_settings(recipient_user_ids).values():
+                if settings and settings.get('telegram_enabled') and settings.get('telegram_chat_id'):
+                    chat_ids.append(str(settings['telegram_chat_id']))
+
+        # 1. DB에 알림 저장 (무조건 실행, 수신자 전체를 한 번에, 재시도 때는 이미 있는 알림 건너뜀)
+        created_at = datetime.now().isoformat()
+        rows = [
+            {
+                "recipient_user_id": recipient_user_id,
+                "message": message,
+                "notification_type": notification_type,
+                "is_read": False,
+                "created_at": created_at,
+                "event_key": event_key
+            }
+            for recipient_user_id in recipient_user_ids
+        ]
+        if event_key:
+            self.supabase.table('notifications')\
+                .upsert(rows, on_conflict='recipient_user_id,event_key', ignore_duplicates=True)\
+                .execute()
+        else:
+            self.supabase.table('notifications').insert(rows).execute()
+
+        # 2. 텔레그램 (같은 채팅방 알림을 모을 수 있게 묶음 시간만큼 늦게 처리)
+        if chat_ids:
+            self.enqueue(
+                [('telegram_message', {"chat_id": chat_id, "message": message}) for chat_id in chat_ids],
+                delay=TELEGRAM_COALESCE_WINDOW,
+                dedupe_keys=[f"{event_key}:{chat_id}" for chat_id in chat_ids] if event_key else None
+            )
+            self.throttle.wake_at(TELEGRAM_COALESCE_WINDOW)
+
+    def send_medication_taken_notification(self, parent_name, medicines, parent_user_id, dose_time='', event_key=None):
+        """복약 완료 알림을 자녀들에게 전송 (dose_time: 체크한 복용 시간, 실패 시 예외 발생)"""
+        dose_label = f"{dose_time} " if dose_time else ""
+        message = f"💊 {parent_name}님이 방금 {dose_label}약을 복용하셨습니다.\n📋 복용약: {format_medicine_list(medicines)}"
+
+        # 자녀 전체에게 한 번에 알림 전송
+        self.notify_users(self.fetch_child_ids(parent_user_id), message, "medication", event_key=event_key)
+
+    def send_dose_schedule_notification(self, event_type, parent_name, medicines, parent_user_id, dose_time, event_key=None):
+        """
+        복용 시간 알림을 자녀들에게 전송 (스케줄러가 넣은 이벤트, 실패 시 예외 발생)
+
+        Args:
+            event_type: 'medication_reminder' (복용 시간) 또는 'missed_dose' (유예 시간까지 미복용)
+            dose_time: 아침/점심/저녁
+        """
+        if event_type == 'missed_dose':
+            message = f"⚠️ {parent_name}님이 {dose_time} 약을 아직 복용하지 않으셨습니다.\n📋 복용약: {format_medicine_list(medicines)}"
+        else:
+            message = f"⏰ {parent_name}님의 {dose_time} 약 복용 시간입니다.\n📋 복용약: {format_medicine_list(medicines)}"
+
+        self.notify_users(self.fetch_child_ids(parent_user_id), message, "reminder", event_key=event_key)
+
+    def handle_medication_taken_event(self, event_type, payload, event_key):
+        self.send_medication_taken_notification(
+            payload.get('parent_name', ''),
+            payload.get('medicines') or [],
+            payload['parent_user_id'],
+            payload.get('dose_time', ''),
+            event_key=event_key
+        )
+
+    def handle_dose_schedule_event(self, event_type, payload, event_key):
+        self.send_dose_schedule_notification(
+            event_type,
+            payload.get('parent_name', ''),
+            payload.get('medicines') or [],
+            payload['parent_user_id'],
+            payload.get('dose_time', ''),
+            event_key=event_key
+        )
+
+    # ---------- 아웃박스 ----------
+    def enqueue(self, events, delay=0, dedupe_keys=None):
+        """
+        (event_type, payload) 목록을 아웃박스에 한 번에 저장 (delay초 뒤부터 처리)
+
+        Args:
+            dedupe_keys: 이벤트별 중복 방지 키 목록. 있으면 같은 키로 이미 저장된 이벤트는 건너뜀
+        """
+        if not events:
+            return
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "event_type": event_type,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": (now + timedelta(seconds=delay)).isoformat(),
+                "created_at": now.isoformat()
+            }
+            for event_type, payload in events
+        ]
+        if dedupe_keys:
+            for row, dedupe_key in zip(rows, dedupe_keys):
+                row["dedupe_key"] = dedupe_key
+            self.supabase.table('notification_outbox')\
+                .upsert(rows, on_conflict='dedupe_key', ignore_duplicates=True)\
+                .execute()
+        else:
+            self.supabase.table('notification_outbox').insert(rows).execute()
+
+    def enqueue_event(self, event_type, payload):
+        """알림 이벤트를 아웃박스에 넣고 워커를 깨움 (전달은 백그라운드에서)"""
+        self.enqueue([(event_type, payload)])
+        self._wake_event.set()
+
+    def _complete(self, event_id):
+        self.supabase.table('notification_outbox')\
+            .update({"status": "done", "processed_at": datetime.now(timezone.utc).isoformat(), "last_error": None})\
+            .eq('id', event_id)\
+            .execute()
+
+    def _fail(self, event_id, attempts, error, retry_after=None):
+        """처리 실패 기록 (retry_after가 없으면 지수 백오프, 최대 횟수를 넘으면 failed)"""
+        print(f"알림 이벤트 {event_id} 처리 실패 ({attempts}회): {error}")
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update = {"status": "failed", "last_error": error}
+        else:
+            # 지수 백오프: 10초, 20초, 40초, ...
+            delay = retry_after if retry_after is not None else 5 * 2 ** attempts
+            retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            update = {"status": "pending", "next_attempt_at": retry_at.isoformat(), "last_error": error}
+        self.supabase.table('notification_outbox').update(update).eq('id', event_id).execute()
+
+    def _release(self, event_id, attempts, delay):
+        """보내지 않고 돌려놓기 (속도 제한 대기, 시도 횟수는 되돌림)"""
+        self.supabase.table('notification_outbox')\
+            .update({
+                "status": "pending",
+                "attempts": attempts - 1,
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat()
+            })\
+            .eq('id', event_id)\
+            .execute()
+
+    def deliver_telegram_events(self, chat_id, events):
+        """
+        한 채팅방의 telegram_message 이벤트들을 한 메시지로 합쳐 전송
+
+        속도 제한에 걸리면 보내지 않고 돌려놓고, 429는 retry_after 뒤에,
+        그 밖의 실패는 아웃박스 백오프로 다시 시도합니다. 성공해야 done이 됩니다.
+
+        Args:
+            events: [(아웃박스 행, 선점 후 시도 횟수), ...] (created_at 순)
+        """
+        # 본문 길이 한도까지만 합치고 나머지는 다음 차례로
+        batch, length = [], 0
+        for event, attempts in events:
+            message = event['payload'].get('message', '')
+            if batch and length + len(message) > TELEGRAM_MAX_LENGTH:
+                self._release(event['id'], attempts, 1 / TELEGRAM_CHAT_RATE)
+                continue
+            batch.append((event, attempts))
+            length += len(message) + 2
+
+        chat_wait, global_wait = self.throttle.acquire(chat_id)
+        while global_wait > 0 and chat_wait == 0:
+            time.sleep(global_wait)
+            chat_wait, global_wait = self.throttle.acquire(chat_id)
+        if chat_wait > 0:
+            for event, attempts in batch:
+                self._release(event['id'], attempts, chat_wait)
+            self.throttle.wake_at(chat_wait)
+            return
+
+        text = "\n\n".join(event['payload'].get('message', '') for event, _ in batch)
+        try:
+            response = self.post_telegram_message(chat_id, text)
+        except Exception as e:
+            response, error = None, str(e)
+
+        if response is not None and response.status_code == 200:
+            now = datetime.now(timezone.utc)
+            latencies = []
+            for event, _ in batch:
+                self._complete(event['id'])
+                if event.get('created_at'):
+                    latencies.append((now - datetime.fromisoformat(event['created_at'])).total_seconds())
+            self.throttle.record('sent', messages=len(batch), latencies=latencies)
+            return
+
+        retry_after = None
+        if response is not None and response.status_code == 429:
+            retry_after = retry_after_seconds(response)
+            self.throttle.record('rate_limited')
+            error = f"텔레그램 429 (retry_after {retry_after:.0f}초)"
+        else:
+            self.throttle.record('failed')
+            if response is not None:
+                error = f"텔레그램 응답 {response.status_code}: {response.text[:200]}"
+        for event, attempts in batch:
+            self._fail(event['id'], attempts, error, retry_after=retry_after)
+
+    def _claim(self, event, now):
+        """
+        선점: 다른 워커가 먼저 가져가지 않았을 때만 processing으로 바꿈
+
+        Returns:
+            선점 후 시도 횟수 (다른 워커가 가져갔으면 None)
+        """
+        attempts = event['attempts'] + 1
+        claimed = self.supabase.table('notification_outbox')\
+            .update({
+                "status": "processing",
+                "attempts": attempts,
+                "next_attempt_at": (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).isoformat()
+            })\
+            .eq('id', event['id'])\
+            .eq('status', event['status'])\
+            .eq('attempts', event['attempts'])\
+            .execute()
+        return attempts if claimed.data else None
+
+    def claim_waiting_telegram_events(self, chat_id, now):
+        """
+        같은 채팅방에서 묶음 시간을 기다리는 telegram_message 이벤트도 선점
+
+        채팅방의 첫 메시지 묶음 시간이 끝나면, 그 뒤에 들어와 아직 시각이 안 된
+        메시지도 같이 보냅니다. 한 번도 시도하지 않은(attempts = 0) 것만 가져오므로
+        429/실패 후 재시도를 기다리는 메시지의 대기 시간은 그대로 지켜집니다.
+        """
+        response = self.supabase.table('notification_outbox')\
+            .select('id, event_type, payload, status, attempts, created_at')\
+            .eq('event_type', 'telegram_message')\
+            .eq('status', 'pending')\
+            .eq('attempts', 0)\
+            .eq('payload->>chat_id', chat_id)\
+            .gt('next_attempt_at', now.isoformat())\
+            .order('created_at')\
+            .limit(OUTBOX_BATCH_SIZE)\
+            .execute()
+
+        claimed = []
+        for event in response.data or []:
+            attempts = self._claim(event, now)
+            if attempts is not None:
+                claimed.append((event, attempts))
+        return claimed
+
+    def process_batch(self):
+        """
+        처리할 아웃박스 이벤트를 한 묶음 가져와 전달
+
+        Returns:
+            이번에 가져온 이벤트 수
+        """
+        now = datetime.now(timezone.utc)
+        response = self.supabase.table('notification_outbox')\
+            .select('id, event_type, payload, status, attempts, created_at')\
+            .in_('status', ['pending', 'processing'])\
+            .lte('next_attempt_at', now.isoformat())\
+            .order('next_attempt_at')\
+            .limit(OUTBOX_BATCH_SIZE)\
+            .execute()
+        events = response.data or []
+
+        telegram_events = {}
+        for event in events:
+            attempts = self._claim(event, now)
+            if attempts is None:
+                continue
+
+            # 텔레그램 메시지는 채팅방별로 모아 한 번에 전송
+            if event['event_type'] == 'telegram_message':
+                telegram_events.setdefault(str(event['payload'].get('chat_id')), []).append((event, attempts))
+                continue
+
+            try:
+                handler = self.handlers[event['event_type']]
+                handler(event['event_type'], event['payload'], f"outbox:{event['id']}")
+                self._complete(event['id'])
+            except Exception as e:
+                self._fail(event['id'], attempts, str(e))
+
+        for chat_id, chat_events in telegram_events.items():
+            try:
+                chat_events.extend(self.claim_waiting_telegram_events(chat_id, now))
+                chat_events.sort(key=lambda item: item[0].get('created_at') or '')
+                self.deliver_telegram_events(chat_id, chat_events)
+            except Exception as e:
+                for event, attempts in chat_events:
+                    self._fail(event['id'], attempts, str(e))
+
+        return len(events)
+
+    def run_worker(self):
+        """아웃박스 워커 루프 (데몬 스레드)"""
+        while True:
+            try:
+                fetched = self.process_batch()
+            except Exception as e:
+                print(f"알림 아웃박스 조회 실패: {str(e)}")
+                fetched = 0
+
+            # 한 묶음을 꽉 채웠으면 남은 이벤트가 있을 수 있으니 바로 다음 묶음 처리
+            if fetched < OUTBOX_BATCH_SIZE:
+                self._wake_event.wait(self.throttle.next_wait(OUTBOX_POLL_INTERVAL))
+                self._wake_event.clear()
+
+    def start(self):
+        worker = threading.Thread(target=self.run_worker, name="notification-outbox", daemon=True)
+        worker.start()
+
+    def wake(self):
+        self._wake_event.set()
@@ -0,0 +1,358 @@
+"""
+복약 시간 알림 스케줄러
+
+Streamlit 앱과 따로 도는 상시 프로세스입니다. 다가오는 복용 건을 시간순 힙에
+넣어 두고, 복용 시간이 되면 자녀에게 복약 알림을, 유예 시간이 지나도 복용
+체크가 없으면 미복용 알림을 알림 아웃박스(notification_outbox)에 넣습니다.
+실제 전달(자녀 조회 → 알림 저장 → 텔레그램)은 이 프로세스에서 같이 도는 아웃박스
+워커(notifications.py)가 하므로 앱 서버가 떠 있지 않아도 알림이 나갑니다.
+
+기록 하나당 복용 시간별로 "다음 알림" 한 건만 힙에 두고, 알림이 나가면 다음 날
+알림을 다시 넣으므로 예약/꺼내기는 O(log n)입니다. 매분 전체 기록을 훑지 않고
+시작할 때 진행 중인 일정만 한 번 읽은 뒤, 새로 저장된 기록만 id 기준으로 이어 읽습니다.
+스케줄러는 한 대만 띄웁니다 (여러 대면 알림이 중복됩니다).
+
+복용 시간은 서버 시간대와 상관없이 DOSE_TIMEZONE(환경변수, 기본 Asia/Seoul) 기준입니다.
+
+실행 (SUPABASE_URL, SUPABASE_KEY, TELEGRAM_BOT_TOKEN, TELEGRAM_ENABLED,
+TELEGRAM_WORKER_PROCESSES는 환경변수 또는 .streamlit/secrets.toml):
+    python scheduler.py run
+    python scheduler.py upcoming
+"""
+import os
+import sys
+import time
+import heapq
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from supabase import create_client
+
+import notifications
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 복용 시간 (medication_times 값 → 알림 시각, DOSE_TIMEZONE 기준)
+DOSE_TIMEZONE = ZoneInfo(os.environ.get("DOSE_TIMEZONE", "Asia/Seoul"))
+DOSE_TIMES = {
+    '아침': (8, 0),
+    '점심': (12, 30),
+    '저녁': (18, 30),
+}
+MISSED_DOSE_GRACE = timedelta(hours=2)  # 복용 시간 후 이만큼 지나도 체크가 없으면 미복용 알림
+REFRESH_INTERVAL = 60  # 초, 새로 저장된 기록 이어 읽기
+RESYNC_INTERVAL = 6 * 60 * 60  # 초, 수정된 일정까지 반영하도록 전체 다시 읽기
+PAGE_SIZE = 1000
+FIRE_BATCH_SIZE = 200  # 한 번에 확인할 최대 알림 수 (in_ 조회 크기)
+
+SCHEDULE_COLUMNS = 'id, patient_name, user_id, medicines, scan_date, medication_duration, medication_times, is_schedule'
+
+REMINDER = 'medication_reminder'
+MISSED = 'missed_dose'
+
+def load_secret(name):
+    """환경변수 → .streamlit/secrets.toml 순으로 설정값 조회"""
+    if os.environ.get(name):
+        return os.environ[name]
+    secrets_path = os.path.join(BASE_DIR, ".streamlit", "secrets.toml")
+    if os.path.exists(secrets_path):
+        import tomllib
+        with open(secrets_path, "rb") as f:
+            return tomllib.load(f).get(name)
+    return None
+
+def load_flag(name):
+    """secrets.toml의 true/false 또는 환경변수 "1"/"true" 값을 bool로"""
+    value = load_secret(name)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+def local_datetime(value):
+    """DB 시각 문자열 → DOSE_TIMEZONE 시각 (시간대 없는 값은 앱이 저장한 한국 시간으로 간주)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=DOSE_TIMEZONE)
+    return parsed.astimezone(DOSE_TIMEZONE)
+
+def local_now():
+    return datetime.now(DOSE_TIMEZONE)
+
+def record_days(record):
+    """기록의 복용 기간 (첫날, 마지막날). 일정 기록이 아니면 scan_date 하루"""
+    first_day = local_datetime(record['scan_date']).date()
+    if record.get('is_schedule'):
+        return first_day, first_day + timedelta(days=max(1, record.get('medication_duration') or 1) - 1)
+    return first_day, first_day
+
+def dose_datetime(day, slot):
+    hour, minute = DOSE_TIMES[slot]
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=DOSE_TIMEZONE)
+
+# ==================== 알림 힙 ====================
+class DoseSchedule:
+    """
+    다가오는 복용 알림의 시간순 힙
+
+    힙 항목은 (알림 시각, 순번, 종류, 기록 id, 복용 시간, 복용 날짜)이고,
+    기록 정보는 id별 dict에 따로 둡니다. 기록이 바뀌면 예전 힙 항목은
+    꺼낼 때 세대(generation)를 비교해 버립니다.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self._generations = {}
+        self._heap = []
+        self._seq = 0
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push(self, fire_at, kind, record_id, slot, day):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_at, self._seq, kind, record_id, slot, day, self._generations[record_id]))
+
+    def add(self, record, now):
+        """기록의 복용 시간별로 now 이후 첫 알림을 예약"""
+        self.max_id = max(self.max_id, record['id'])
+        times = [slot for slot in record.get('medication_times') or [] if slot in DOSE_TIMES]
+        if not record.get('user_id') or not times:
+            return
+
+        self.records[record['id']] = record
+        self._generations[record['id']] = self._generations.get(record['id'], 0) + 1
+        first_day, last_day = record_days(record)
+        for slot in times:
+            self.schedule_next(record['id'], slot, max(first_day, now.date()), now)
+            # 재시작 직후: 복용 시간은 지났지만 미복용 확인 시각이 남은 건
+            missed_at = dose_datetime(now.date(), slot) + MISSED_DOSE_GRACE
+            if first_day <= now.date() <= last_day and dose_datetime(now.date(), slot) <= now < missed_at:
+                self._push(missed_at, MISSED, record['id'], slot, now.date())
+
+    def schedule_next(self, record_id, slot, day, now):
+        """day부터 복용 기간 안에서 now 이후 첫 복약 알림 예약"""
+        _, last_day = record_days(self.records[record_id])
+        while day <= last_day:
+            fire_at = dose_datetime(day, slot)
+            if fire_at > now:
+                self._push(fire_at, REMINDER, record_id, slot, day)
+                return
+            day += timedelta(days=1)
+
+    def next_fire_at(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit=FIRE_BATCH_SIZE):
+        """
+        now까지 시각이 된 알림 꺼내기 (기록이 바뀌어 무효가 된 항목은 버림)
+
+        꺼낸 알림은 아웃박스 저장이 끝난 뒤 advance()로 다음 알림을 예약하고,
+        실패하면 requeue()로 힙에 되돌립니다.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < limit:
+            fire_at, _, kind, record_id, slot, day, generation = heapq.heappop(self._heap)
+            if self._generations.get(record_id) != generation:
+                continue
+            due.append((fire_at, kind, record_id, slot, day))
+        return due
+
+    def advance(self, due):
+        """보낸 복약 알림마다 미복용 확인과 다음 날 알림 예약"""
+        for fire_at, kind, record_id, slot, day in due:
+            if kind == REMINDER and record_id in self.records:
+                self._push(fire_at + MISSED_DOSE_GRACE, MISSED, record_id, slot, day)
+                self.schedule_next(record_id, slot, day + timedelta(days=1), fire_at)
+
+    def requeue(self, due):
+        """저장에 실패한 알림을 그대로 힙에 되돌리기 (다음 주기에 다시 시도)"""
+        for fire_at, kind, record_id, slot, day in due:
+            if record_id in self.records:
+                self._push(fire_at, kind, record_id, slot, day)
+
+    def discard(self, record_id):
+        """삭제된 기록의 남은 알림 무효화"""
+        self.records.pop(record_id, None)
+        self._generations[record_id] = self._generations.get(record_id, 0) + 1
+
+    def upcoming(self, limit=20):
+        return [
+            entry for entry in heapq.nsmallest(limit * 2, self._heap)
+            if self._generations.get(entry[3]) == entry[6]
+        ][:limit]
+
+# ==================== Supabase 조회 ====================
+def fetch_active_records(supabase, today, after_id=0):
+    """
+    알림이 남은 기록을 id 순으로 페이지 단위 조회
+
+    진행 중인 일정(is_schedule, end_date >= 오늘)과 오늘 이후 날짜별 기록만 가져옵니다.
+    """
+    records = []
+    while True:
+        response = supabase.table('medicine_records')\
+            .select(SCHEDULE_COLUMNS)\
+            .gt('id', after_id)\
+            .not_.is_('user_id', 'null')\
+            .or_(f"and(is_schedule.eq.true,end_date.gte.{today}),scan_date.gte.{today}T00:00:00")\
+            .order('id')\
+            .limit(PAGE_SIZE)\
+            .execute()
+        page = response.data or []
+        records.extend(page)
+        if len(page) < PAGE_SIZE:
+            return records
+        after_id = page[-1]['id']
+
+def fetch_dose_states(supabase, due):
+    """
+    꺼낸 알림들의 현재 상태를 한 번에 조회
+
+    Returns:
+        ({기록 id: medicine_records 행}, {(기록 id, 'YYYY-MM-DD', 복용 시간): medication_doses 행})
+        복용 시간이 ''인 행은 그날 전체 (제외 표시, 복용 시간별 체크 전에 날짜별로 한 체크)
+    """
+    record_ids = sorted({record_id for _, _, record_id, _, _ in due})
+    response = supabase.table('medicine_records')\
+        .select('id, taken, medication_times, is_schedule')\
+        .in_('id', record_ids)\
+        .execute()
+    records = {record['id']: record for record in response.data or []}
+
+    doses = {}
+    days = sorted({day.isoformat() for _, _, _, _, day in due})
+    dose_response = supabase.table('medication_doses')\
+        .select('record_id, dose_date, dose_time, taken, skipped')\
+        .in_('record_id', record_ids)\
+        .gte('dose_date', days[0])\
+        .lte('dose_date', days[-1])\
+        .execute()
+    for dose in dose_response.data or []:
+        doses[(dose['record_id'], dose['dose_date'][:10], dose.get('dose_time') or '')] = dose
+    return records, doses
+
+def build_events(schedule, due, records, doses):
+    """
+    아직 유효한 알림만 아웃박스 이벤트로 변환 (삭제/제외/복용 완료된 건은 건너뜀)
+
+    Returns:
+        [(event_type, payload), ...]
+    """
+    events = []
+    for fire_at, kind, record_id, slot, day in due:
+        current = records.get(record_id)
+        if current is None:
+            schedule.discard(record_id)
+            continue
+        times = current.get('medication_times') or []
+        if slot not in times:
+            continue
+        if current.get('is_schedule'):
+            whole_day = doses.get((record_id, day.isoformat(), '')) or {}
+            dose = doses.get((record_id, day.isoformat(), slot)) or {}
+            if whole_day.get('skipped') or whole_day.get('taken') or dose.get('taken'):
+                continue
+        elif current.get('taken'):
+            continue
+
+        record = schedule.records[record_id]
+        events.append((kind, {
+            "parent_name": record.get('patient_name', ''),
+            "parent_user_id": record['user_id'],
+            "medicines": record.get('medicines') or [],
+            "dose_time": slot,
+            "dose_date": day.isoformat()
+        }))
+    return events
+
+# ==================== 스케줄러 루프 ====================
+def load_schedule(supabase, now):
+    schedule = DoseSchedule()
+    for record in fetch_active_records(supabase, now.date()):
+        schedule.add(record, now)
+    return schedule
+
+def fire_due(supabase, outbox, schedule, now):
+    """시각이 된 알림을 묶음으로 확인해 아웃박스에 넣기. 넣은 이벤트 수 반환"""
+    sent = 0
+    while True:
+        due = schedule.pop_due(now)
+        if not due:
+            if sent:
+                outbox.wake()
+            return sent
+        try:
+            records, doses = fetch_dose_states(supabase, due)
+            events = build_events(schedule, due, records, doses)
+            outbox.enqueue(events)
+        except Exception:
+            schedule.requeue(due)
+            raise
+        schedule.advance(due)
+        sent += len(events)
+
+def run(supabase, outbox):
+    """스케줄러 루프 + 아웃박스 워커 스레드 (Ctrl+C로 종료)"""
+    outbox.start()
+    now = local_now()
+    schedule = load_schedule(supabase, now)
+    print(f"⏰ 기록 {len(schedule.records)}건, 알림 {len(schedule)}건 예약")
+    refreshed_at = resynced_at = time.monotonic()
+
+    while True:
+        try:
+            if time.monotonic() - resynced_at >= RESYNC_INTERVAL:
+                schedule = load_schedule(supabase, local_now())
+                refreshed_at = resynced_at = time.monotonic()
+            elif time.monotonic() - refreshed_at >= REFRESH_INTERVAL:
+                now = local_now()
+                for record in fetch_active_records(supabase, now.date(), after_id=schedule.max_id):
+                    schedule.add(record, now)
+                refreshed_at = time.monotonic()
+
+            sent = fire_due(supabase, outbox, schedule, local_now())
+            if sent:
+                print(f"📮 {local_now():%Y-%m-%d %H:%M} 알림 {sent}건 아웃박스에 저장")
+        except Exception as e:
+            # 조회/저장 실패는 다음 주기에 다시 시도 (꺼낸 알림은 힙에 되돌려 둠)
+            print(f"스케줄러 처리 실패: {str(e)}")
+
+        # 다음 알림 시각이나 다음 새로 읽기 중 빠른 쪽까지 대기
+        wait = REFRESH_INTERVAL - (time.monotonic() - refreshed_at)
+        next_fire_at = schedule.next_fire_at()
+        if next_fire_at is not None:
+            wait = min(wait, (next_fire_at - local_now()).total_seconds())
+        time.sleep(max(1.0, wait))
+
+def main(argv):
+    url = load_secret("SUPABASE_URL")
+    key = load_secret("SUPABASE_KEY")
+    if not url or not key:
+        print("SUPABASE_URL, SUPABASE_KEY가 없습니다 (환경변수 또는 .streamlit/secrets.toml)")
+        return 1
+
+    if len(argv) >= 2 and argv[1] == "run":
+        supabase = create_client(url, key)
+        outbox = notifications.NotificationOutbox(
+            supabase,
+            bot_token=load_secret("TELEGRAM_BOT_TOKEN"),
+            telegram_enabled=load_flag("TELEGRAM_ENABLED"),
+            worker_processes=load_secret("TELEGRAM_WORKER_PROCESSES") or notifications.TELEGRAM_WORKER_PROCESSES
+        )
+        try:
+            run(supabase, outbox)
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if len(argv) >= 2 and argv[1] == "upcoming":
+        schedule = load_schedule(create_client(url, key), local_now())
+        for fire_at, _, kind, record_id, slot, day, _ in schedule.upcoming():
+            record = schedule.records[record_id]
+            print(f"{fire_at:%Y-%m-%d %H:%M}  {kind:<20} {record.get('patient_name', '')} {slot} (기록 {record_id})")
+        return 0
+    print(__doc__)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
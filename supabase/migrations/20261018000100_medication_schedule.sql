@@ -0,0 +1,26 @@
+-- 복약 일정 모델
+-- 처방 1건 = medicine_records 일정 행 1개 (시작일 scan_date, 기간 medication_duration,
+-- 시간 medication_times). 날짜별 복용 건은 앱에서 펼치고, 복용/제외 여부만
+-- medication_doses에 날짜별로 기록합니다. is_schedule = false인 기존 날짜별 행은 그대로 동작합니다.
+
+ALTER TABLE medicine_records
+    ADD COLUMN IF NOT EXISTS is_schedule boolean NOT NULL DEFAULT false;
+
+CREATE TABLE IF NOT EXISTS medication_doses (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    record_id bigint NOT NULL REFERENCES medicine_records(id) ON DELETE CASCADE,
+    dose_date date NOT NULL,
+    taken boolean NOT NULL DEFAULT false,
+    taken_at timestamptz,
+    skipped boolean NOT NULL DEFAULT false,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    UNIQUE (record_id, dose_date)
+);
+
+-- 기간 겹침 조회 (scan_date < 끝, end_date >= 시작)
+CREATE INDEX IF NOT EXISTS medicine_records_patient_scan_date_idx
+    ON medicine_records (patient_name, scan_date);
+CREATE INDEX IF NOT EXISTS medicine_records_user_scan_date_idx
+    ON medicine_records (user_id, scan_date);
+CREATE INDEX IF NOT EXISTS medicine_records_schedule_end_date_idx
+    ON medicine_records (patient_name, end_date) WHERE is_schedule;
@@ -0,0 +1,22 @@
+-- 알림 아웃박스
+-- 복용 완료 등 알림 이벤트를 먼저 여기에 저장하고, 앱 서버의 백그라운드 워커가
+-- 자녀 조회 → 알림 저장 → 텔레그램 전송을 처리합니다.
+-- status: pending → processing → done / failed (최대 재시도 초과)
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    event_type text NOT NULL,
+    payload jsonb NOT NULL,
+    status text NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'processing', 'done', 'failed')),
+    attempts integer NOT NULL DEFAULT 0,
+    next_attempt_at timestamptz NOT NULL DEFAULT now(),
+    last_error text,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    processed_at timestamptz
+);
+
+-- 워커가 처리할 이벤트를 찾는 조회용
+CREATE INDEX IF NOT EXISTS notification_outbox_due_idx
+    ON notification_outbox (next_attempt_at)
+    WHERE status IN ('pending', 'processing');
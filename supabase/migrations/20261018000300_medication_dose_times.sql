@@ -0,0 +1,13 @@
+-- 복용 체크를 복용 시간(아침/점심/저녁)별로 기록
+-- dose_time = '' 행은 그날 전체 (제외 표시, 복용 시간이 없는 기록의 복용 체크,
+-- 이 마이그레이션 전에 날짜별로 한 번 체크한 기록)입니다.
+
+ALTER TABLE medication_doses
+    ADD COLUMN IF NOT EXISTS dose_time text NOT NULL DEFAULT '';
+
+ALTER TABLE medication_doses
+    DROP CONSTRAINT IF EXISTS medication_doses_record_id_dose_date_key;
+
+ALTER TABLE medication_doses
+    ADD CONSTRAINT medication_doses_record_id_dose_date_dose_time_key
+    UNIQUE (record_id, dose_date, dose_time);
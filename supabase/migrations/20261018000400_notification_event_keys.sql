@@ -0,0 +1,17 @@
+-- 알림 중복 방지 키
+-- 아웃박스 이벤트를 재시도해도 그 이벤트가 이미 만든 DB 알림/텔레그램 이벤트는
+-- 다시 생기지 않도록 이벤트 키로 upsert(중복 무시)합니다. 키가 없는 행(NULL)은 제한 없음.
+
+ALTER TABLE notifications
+    ADD COLUMN IF NOT EXISTS event_key text;
+
+ALTER TABLE notifications
+    ADD CONSTRAINT notifications_recipient_user_id_event_key_key
+    UNIQUE (recipient_user_id, event_key);
+
+ALTER TABLE notification_outbox
+    ADD COLUMN IF NOT EXISTS dedupe_key text;
+
+ALTER TABLE notification_outbox
+    ADD CONSTRAINT notification_outbox_dedupe_key_key
+    UNIQUE (dedupe_key);
@@ -0,0 +1,11 @@
+-- 복약 일정 저장 중복 방지
+-- 앱이 스캔 결과마다 만든 키(스캔 작업 ID:약봉지 번호)로 upsert(중복 무시)해서
+-- 응답을 못 받아 다시 저장하거나 저장 버튼을 두 번 눌러도 일정이 한 번만 들어갑니다.
+-- 수동 입력처럼 키가 없는 행(NULL)은 제한 없음.
+
+ALTER TABLE medicine_records
+    ADD COLUMN IF NOT EXISTS save_key text;
+
+ALTER TABLE medicine_records
+    ADD CONSTRAINT medicine_records_save_key_key
+    UNIQUE (save_key);